@@ -0,0 +1,2 @@
+# Módulos compartidos por la app Flask y flex_sync_agent.py. No deben importar
+# flask_app: el agente los usa sin construir la aplicación.
@@ -0,0 +1,36 @@
+import os
+import socket
+
+# Aviso al agente de sincronización (flex_sync_agent.py --daemon) de que se
+# registró una venta: un datagrama UDP local que lo despierta sin esperar su
+# siguiente consulta. Es "best effort": si el agente no está escuchando o el
+# datagrama se pierde, la venta sigue pendiente en vta_ventas y el agente la
+# encuentra en su consulta periódica. Sin SYNC_AGENT_NOTIFY_ADDR no se envía nada.
+SYNC_AGENT_NOTIFY_ADDR = os.environ.get('SYNC_AGENT_NOTIFY_ADDR', '')
+
+
+def parse_direccion(valor):
+    """'host:puerto' o 'puerto' -> (host, puerto); None si está vacío o es inválido."""
+    valor = (valor or '').strip()
+    if not valor:
+        return None
+    host, _, puerto = valor.rpartition(':')
+    try:
+        return (host or '127.0.0.1', int(puerto))
+    except ValueError:
+        print(f"[AVISO SYNC] Dirección inválida: {valor!r}")
+        return None
+
+
+_destino = parse_direccion(SYNC_AGENT_NOTIFY_ADDR)
+
+
+def avisar_venta(id_venta):
+    """Avisa al agente que hay una venta nueva. Nunca lanza excepciones."""
+    if not _destino:
+        return
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.sendto(str(id_venta).encode('ascii'), _destino)
+    except OSError as e:
+        print(f"[AVISO SYNC] No se pudo avisar la venta {id_venta}: {e}")
@@ -0,0 +1,48 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Cache en memoria, segura entre hilos, con expiración (TTL) y tamaño acotado.
+
+    Al superar `max_size` se descarta la entrada usada hace más tiempo (LRU).
+    Las entradas vencidas no se devuelven salvo que se pida `allow_stale=True`,
+    útil para seguir sirviendo el último dato conocido si el origen falla.
+    """
+
+    def __init__(self, ttl, max_size=128):
+        self.ttl = ttl
+        self.max_size = max(1, int(max_size))
+        self._data = OrderedDict()  # key -> (valor, momento de carga)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None, allow_stale=False):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, stored_at = entry
+            if not allow_stale and time.monotonic() - stored_at > self.ttl:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Elimina una clave o, sin argumentos, vacía la cache completa."""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
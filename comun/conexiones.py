@@ -0,0 +1,452 @@
+import pymysql.cursors
+import pyodbc
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+
+class DatabaseError(Exception):
+    """Error al ejecutar una query (ver DatabaseUnavailable y QueryError)."""
+
+
+class DatabaseUnavailable(DatabaseError):
+    """No se pudo hablar con la base de datos (conexión caída, pool agotado,
+    deadlock o lock timeout). Es transitorio: tiene sentido reintentar."""
+
+
+class QueryError(DatabaseError):
+    """La base de datos rechazó la query (sintaxis, columna inexistente,
+    restricción violada). Reintentar la misma query no sirve."""
+
+
+class PoolTimeout(DatabaseUnavailable):
+    """No se liberó ninguna conexión del pool dentro del tiempo de espera."""
+
+
+# Errores MySQL transitorios del servidor: demasiadas conexiones, lock wait timeout, deadlock.
+# Los códigos 2000 en adelante son errores del cliente (no conecta, server gone away, ...).
+_MYSQL_TRANSIENT_ERRNOS = {1040, 1205, 1213}
+
+
+def translate_mysql_error(e):
+    """Convierte una excepción de pymysql (o del pool) en DatabaseUnavailable / QueryError."""
+    if isinstance(e, DatabaseError):
+        return e
+    errno = e.args[0] if e.args and isinstance(e.args[0], int) else None
+    if isinstance(e, pymysql.err.InterfaceError) or (errno is not None and (errno >= 2000 or errno in _MYSQL_TRANSIENT_ERRNOS)):
+        return DatabaseUnavailable(str(e))
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return DatabaseUnavailable(str(e))
+    return QueryError(str(e))
+
+
+@lru_cache(maxsize=512)
+def statement_kind(query):
+    """'select', 'insert' u 'other' según el comienzo de la query.
+    Cacheado por texto: las queries de la app son casi siempre las mismas cadenas."""
+    head = query.lstrip()[:6].lower()
+    if head == 'select':
+        return 'select'
+    if head == 'insert':
+        return 'insert'
+    return 'other'
+
+
+# Conexiones fijadas al request actual (ver begin_request_scope / end_request_scope).
+# Cada hilo del servidor atiende un request a la vez, por eso basta un threading.local.
+_request_state = threading.local()
+
+
+def begin_request_scope():
+    """Activa el checkout por request: todas las queries del request actual
+    reutilizan la misma conexión de cada pool hasta end_request_scope()."""
+    _request_state.conns = {}
+
+
+def end_request_scope():
+    """Devuelve a sus pools las conexiones fijadas durante el request."""
+    conns = getattr(_request_state, 'conns', None)
+    _request_state.conns = None
+    if not conns:
+        return
+    for pool, conn in conns.items():
+        pool.release(conn)
+
+
+def release_request_connections():
+    """Devuelve ya a sus pools las conexiones fijadas al request, sin cerrar el scope:
+    la próxima query vuelve a pedir una. Se llama antes de trabajo lento que no usa
+    la base (Factura X, SMTP, generar un export) para no retener un cupo del pool."""
+    conns = getattr(_request_state, 'conns', None)
+    if not conns:
+        return
+    _request_state.conns = {}
+    for pool, conn in conns.items():
+        pool.release(conn)
+
+
+class ConnectionPool:
+    """Pool de conexiones acotado y seguro entre hilos.
+
+    - `max_size` limita las conexiones abiertas (en uso + ociosas); si no hay
+      ninguna libre, acquire() espera hasta `acquire_timeout` segundos.
+    - Las conexiones ociosas más de `max_idle` segundos se cierran.
+    - Antes de entregar una conexión que estuvo ociosa más de `check_after`
+      segundos se valida con `ping`; si falla se descarta y se abre otra.
+    """
+
+    def __init__(self, factory, ping, max_size=10, max_idle=300, check_after=5, acquire_timeout=10, name='pool'):
+        self._factory = factory
+        self._ping = ping
+        self.max_size = max(1, int(max_size))
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.acquire_timeout = acquire_timeout
+        self.name = name
+        self._idle = deque()  # (conexion, momento en que se devolvió)
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle_locked(self):
+        # Las más antiguas quedan a la izquierda (se entrega siempre la última devuelta)
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._close(conn)
+
+    def _is_alive(self, conn):
+        try:
+            self._ping(conn)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            conn = None
+            idle_since = None
+            with self._cond:
+                while True:
+                    self._evict_idle_locked()
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # Reservar el cupo antes de conectar fuera del lock
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"[{self.name}] sin conexiones libres tras {self.acquire_timeout}s")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._factory()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if time.monotonic() - idle_since <= self.check_after or self._is_alive(conn):
+                return conn
+            # Conexión muerta (timeout del servidor, red caída): descartar y reintentar
+            self.release(conn, discard=True)
+
+    def release(self, conn, discard=False):
+        with self._cond:
+            if discard:
+                self._size -= 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Entrega una conexión del pool y la devuelve al terminar.
+        Si hay un request activo, la conexión queda fijada hasta el fin del request.
+        Ante un error dentro del bloque la conexión se descarta por seguridad."""
+        scoped = getattr(_request_state, 'conns', None)
+        if scoped is not None:
+            conn = scoped.get(self)
+            if conn is None:
+                conn = self.acquire()
+                scoped[self] = conn
+            try:
+                yield conn
+            except Exception:
+                scoped.pop(self, None)
+                self.release(conn, discard=True)
+                raise
+            return
+
+        conn = self.acquire()
+        completed = False
+        try:
+            yield conn
+            completed = True
+        finally:
+            # También ante GeneratorExit/KeyboardInterrupt: si no, el cupo del pool se pierde
+            self.release(conn, discard=not completed)
+
+    def close_all(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close(conn)
+            self._cond.notify_all()
+
+
+_mysql_pools = {}
+_mysql_pools_lock = threading.Lock()
+
+
+def _open_mysql(db):
+    connection = pymysql.connect(
+        host=os.environ.get('DB_HOST', '181.212.204.13'),
+        port=int(os.environ.get('DB_PORT', 3306)),
+        user=os.environ.get('DB_USER', 'sistemasu'),
+        password=os.environ.get('DB_PASSWORD', '5rTF422.3E'),
+        db=db,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor
+    )
+    connection.autocommit(True)
+    return connection
+
+
+def get_mysql_pool(db='sistemas'):
+    """Pool compartido por base de datos. Tamaños configurables por entorno."""
+    with _mysql_pools_lock:
+        pool = _mysql_pools.get(db)
+        if pool is None:
+            pool = ConnectionPool(
+                factory=lambda: _open_mysql(db),
+                ping=lambda conn: conn.ping(reconnect=False),
+                max_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+                max_idle=float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+                acquire_timeout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                name=f'mysql:{db}'
+            )
+            _mysql_pools[db] = pool
+        return pool
+
+
+class MySQLConnection:
+    def __init__(self, db='sistemas'):
+        # Ya no abre un socket propio: las queries piden prestada una conexión al pool
+        self.pool = get_mysql_pool(db)
+
+    @contextmanager
+    def _cursor(self):
+        try:
+            with self.pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    yield cursor
+        except Exception as e:
+            raise translate_mysql_error(e) from e
+
+    # API explícita: cada método sabe qué devolver y los errores se propagan como
+    # DatabaseUnavailable (reintentable) o QueryError. Las conexiones del pool están
+    # en autocommit, por eso no hace falta un COMMIT extra tras cada escritura.
+
+    def fetch_all(self, query, data=None):
+        """Filas del SELECT como lista de dicts ([] si no hay filas)."""
+        with self._cursor() as cursor:
+            cursor.execute(query, data or None)
+            return list(cursor.fetchall())
+
+    def fetch_one(self, query, data=None):
+        """Primera fila del SELECT, o None si no hay filas."""
+        with self._cursor() as cursor:
+            cursor.execute(query, data or None)
+            return cursor.fetchone()
+
+    def execute(self, query, data=None):
+        """Ejecuta un UPDATE/DELETE/DDL y devuelve la cantidad de filas afectadas."""
+        with self._cursor() as cursor:
+            return cursor.execute(query, data or None)
+
+    def insert(self, query, data=None):
+        """Ejecuta un INSERT y devuelve el id generado."""
+        with self._cursor() as cursor:
+            cursor.execute(query, data or None)
+            return cursor.lastrowid
+
+    def execute_many(self, query, seq_of_data):
+        """Ejecuta la query para cada elemento de `seq_of_data` (los INSERT se
+        envían como un único INSERT multi-fila). Devuelve las filas afectadas."""
+        with self._cursor() as cursor:
+            return cursor.executemany(query, seq_of_data)
+
+    def query_db(self, query, data=None):
+        """Interfaz histórica: deduce el tipo de query y, ante un error, lo imprime
+        y devuelve [] (SELECT) o False. El código nuevo debería usar los métodos
+        explícitos para distinguir "sin filas" de "base de datos caída".
+
+        PoolTimeout sí se propaga: un pool agotado no es "sin filas" y la app lo
+        responde como 503 (ver el errorhandler en flask_app/__init__.py)."""
+        kind = statement_kind(query)
+        try:
+            if kind == 'select':
+                return self.fetch_all(query, data)
+            if kind == 'insert':
+                return self.insert(query, data)
+            self.execute(query, data)
+            return True
+        except PoolTimeout:
+            raise
+        except DatabaseError as e:
+            print("[MySQLConnection] Error:", e)
+            if kind == 'select':
+                return []
+            return False
+
+    def iter_query(self, query, data=None, batch_size=1000):
+        """Itera las filas de un SELECT con un cursor del lado del servidor
+        (SSDictCursor): las filas llegan por bloques de `batch_size` y nunca se
+        cargan todas en memoria. Pensado para exportaciones y procesos batch.
+
+        Usa una conexión propia del pool (no la del request) porque mientras el
+        cursor está abierto la conexión no admite otras queries. Si la iteración
+        se abandona a medias la conexión se descarta en vez de volver al pool.
+        Los errores se propagan como DatabaseUnavailable / QueryError."""
+        try:
+            connection = self.pool.acquire()
+        except Exception as e:
+            raise translate_mysql_error(e) from e
+        completed = False
+        try:
+            with connection.cursor(pymysql.cursors.SSDictCursor) as cursor:
+                cursor.execute(query, data or None)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            completed = True
+        except Exception as e:
+            raise translate_mysql_error(e) from e
+        finally:
+            self.pool.release(connection, discard=not completed)
+
+    @contextmanager
+    def transaction(self):
+        """Entrega un cursor sobre una única conexión dentro de una transacción:
+        commit al salir del bloque, rollback (y excepción) si algo falla.
+        Los errores de MySQL se propagan como DatabaseUnavailable / QueryError."""
+        try:
+            with self.pool.connection() as connection:
+                connection.begin()
+                try:
+                    with connection.cursor() as cursor:
+                        yield cursor
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+        except pymysql.MySQLError as e:
+            raise translate_mysql_error(e) from e
+
+def connectToMySQL(db):
+    return MySQLConnection(db)
+
+_sqlserver_pools = {}
+_sqlserver_pools_lock = threading.Lock()
+
+# Errores de pyodbc que indican una conexión rota (no un error de la query)
+_SQLSERVER_CONNECTION_ERRORS = (pyodbc.OperationalError, pyodbc.InterfaceError)
+
+
+def _open_sqlserver(db, user, password):
+    # Usa un driver más universal y moderno para Linux y Windows
+    connection_str = (
+        "DRIVER={ODBC Driver 17 for SQL Server};"
+        f"SERVER={os.environ.get('SQLSERVER_HOST', '192.168.1.150')},{os.environ.get('SQLSERVER_PORT', 1433)};"
+        f"DATABASE={db};"
+        f"UID={user};"
+        f"PWD={password};"
+    )
+    # autocommit evita devolver al pool conexiones con transacciones abiertas
+    return pyodbc.connect(connection_str, autocommit=True)
+
+
+def _ping_sqlserver(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1").fetchone()
+    finally:
+        cursor.close()
+
+
+def get_sqlserver_pool(db='BDFlexline', user='flexline', password='flexline'):
+    """Pool compartido de conexiones ODBC a Flexline (app Flask y flex_sync_agent)."""
+    key = (db, user)
+    with _sqlserver_pools_lock:
+        pool = _sqlserver_pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                factory=lambda: _open_sqlserver(db, user, password),
+                ping=_ping_sqlserver,
+                max_size=int(os.environ.get('SQLSERVER_POOL_SIZE', 5)),
+                max_idle=float(os.environ.get('SQLSERVER_POOL_MAX_IDLE', 300)),
+                acquire_timeout=float(os.environ.get('SQLSERVER_POOL_TIMEOUT', 15)),
+                name=f'sqlserver:{db}'
+            )
+            _sqlserver_pools[key] = pool
+        return pool
+
+
+def run_sqlserver_query(pool, query, data=None):
+    """Ejecuta una query con una conexión del pool. Si la conexión resulta estar
+    rota se descarta y se reintenta una vez con una conexión nueva.
+    Las demás excepciones se propagan al llamador."""
+    for attempt in range(2):
+        try:
+            with pool.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    if data:
+                        cursor.execute(query, data)
+                    else:
+                        cursor.execute(query)
+                    kind = statement_kind(query)
+                    if kind == 'select':
+                        return [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
+                    elif kind == 'insert':
+                        return cursor.lastrowid
+                    return True
+                finally:
+                    cursor.close()
+        except _SQLSERVER_CONNECTION_ERRORS:
+            if attempt == 1:
+                raise
+
+
+class SQLServerConnection:
+    def __init__(self, db='BDFlexline', user='flexline', password='flexline'):
+        self.pool = get_sqlserver_pool(db, user, password)
+
+    def query_db(self, query, data=None):
+        try:
+            return run_sqlserver_query(self.pool, query, data)
+        except Exception as e:
+            print("SQL Server error:", e)
+            return []
+
+def connectToSQLServer(db='BDFlexline', user='flexline', password='flexline'):
+    return SQLServerConnection(db, user, password)
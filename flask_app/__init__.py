@@ -26,6 +26,9 @@ app.secret_key = os.environ.get('FLASK_SECRET_KEY', "Llave muy secreta")
 # Flag para activar logs de diagnóstico de login sin cambiar código en rutas.
 app.config['LOGIN_DEBUG'] = os.environ.get('LOGIN_DEBUG', '0') == '1'
 
+# Token para operaciones administrativas vía API/CLI (p. ej. invalidar cache de catálogo)
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+
 # Configuración de correo (se puede establecer en .env)
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'localhost')
 app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 25) or 25)
@@ -36,6 +39,30 @@ app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL', '0') == '1'
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', f"no-reply@{app.config['MAIL_SERVER']}")
 
 
+# Checkout por request del pool MySQL: todas las queries de un request comparten
+# una misma conexión, que se pide en la primera query y vuelve al pool cuando el
+# request termina (o antes, con release_request_connections()).
+from flask_app.config.conexiones import begin_request_scope, end_request_scope, DatabaseUnavailable
+
+
+@app.before_request
+def _abrir_scope_conexiones():
+	begin_request_scope()
+
+
+@app.teardown_request
+def _cerrar_scope_conexiones(exc=None):
+	end_request_scope()
+
+
+@app.errorhandler(DatabaseUnavailable)
+def _base_no_disponible(e):
+	# Pool agotado o base caída: 503 para que el cliente reintente, en vez de
+	# mostrar la página como si no hubiera datos.
+	print(f"[DB] No disponible: {e}")
+	return "Servicio temporalmente no disponible, intente nuevamente.", 503, {'Retry-After': '5'}
+
+
 @app.template_filter('datetimeformat')
 def datetimeformat(value, fmt='%d-%m-%Y %H:%M'):
 	"""Format a datetime or string to a readable format for templates.
@@ -72,4 +99,12 @@ def datetimeformat(value, fmt='%d-%m-%Y %H:%M'):
 	try:
 		return str(value)
 	except Exception:
-		return '-'
\ No newline at end of file
+		return '-'
+
+
+# Workers de la cola de correos: se inician al cargar la app (también bajo un
+# servidor WSGI) y retoman los pendientes de la ejecución anterior. Con el
+# reloader de debug sólo el proceso hijo (WERKZEUG_RUN_MAIN) atiende requests.
+if os.environ.get('FLASK_DEBUG', '0') != '1' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+	from flask_app.config.mailer import start_mail_workers
+	start_mail_workers()
@@ -0,0 +1,107 @@
+"""Comandos de administración para `flask --app server <comando>`."""
+import click
+import requests
+
+from flask_app import app
+from flask_app.models.apertura import Apertura
+from flask_app.config.conexiones import DatabaseError
+from flask_app.config.migraciones import aplicar_migraciones, listar_migraciones, versiones_aplicadas, verificar_planes
+
+
+def _post_admin(url, path):
+    """POST autenticado con ADMIN_TOKEN contra el servidor en ejecución."""
+    token = app.config.get('ADMIN_TOKEN')
+    if not token:
+        raise click.ClickException('Defina ADMIN_TOKEN (igual que en el servidor) para usar este comando.')
+    try:
+        resp = requests.post(url.rstrip('/') + path, headers={'X-Admin-Token': token}, timeout=10)
+    except requests.exceptions.RequestException as e:
+        raise click.ClickException(f'No se pudo contactar al servidor: {e}')
+    if resp.status_code != 200:
+        raise click.ClickException(f'El servidor respondió {resp.status_code}: {resp.text}')
+    return resp
+
+
+@app.cli.command('invalidar-catalogo')
+@click.option('--caja', type=int, default=None, help='ID de caja (por defecto: todas)')
+@click.option('--url', default='http://127.0.0.1:5001', show_default=True, help='URL del servidor en ejecución')
+def invalidar_catalogo(caja, url):
+    """Invalida el catálogo cacheado en el servidor en ejecución.
+
+    La cache vive en memoria del proceso web, por eso el comando llama al
+    endpoint de invalidación autenticándose con ADMIN_TOKEN.
+    """
+    path = f'/api/caja/{caja}/productos/invalidar' if caja else '/api/productos/invalidar'
+    _post_admin(url, path)
+    click.echo(f"Catálogo invalidado ({'caja ' + str(caja) if caja else 'todas las cajas'}).")
+
+
+@app.cli.command('invalidar-permisos')
+@click.option('--usuario', type=int, default=None, help='ID de usuario (por defecto: todos)')
+@click.option('--url', default='http://127.0.0.1:5001', show_default=True, help='URL del servidor en ejecución')
+def invalidar_permisos(usuario, url):
+    """Descarta los permisos cacheados en el servidor tras modificar vta_permiso_usuarios."""
+    path = f'/api/usuarios/{usuario}/contexto/invalidar' if usuario else '/api/usuarios/contexto/invalidar'
+    _post_admin(url, path)
+    click.echo(f"Permisos invalidados ({'usuario ' + str(usuario) if usuario else 'todos los usuarios'}).")
+
+
+@app.cli.command('reconciliar-totales')
+@click.option('--apertura', type=int, default=None, help='ID de apertura (por defecto: todas)')
+@click.option('--corregir', is_flag=True, help='Reescribe los totales acumulados con la suma real')
+def reconciliar_totales(apertura, corregir):
+    """Verifica monto_acumulado/ventas_acumuladas de vta_apertura contra vta_ventas."""
+    if not Apertura.has_running_totals():
+        raise click.ClickException('vta_apertura no tiene las columnas monto_acumulado/ventas_acumuladas: ejecute flask migrar.')
+    try:
+        diferencias = Apertura.reconcile_totals(apertura, fix=corregir)
+    except DatabaseError as e:
+        raise click.ClickException(f'Error de base de datos: {e}')
+    for d in diferencias:
+        click.echo(
+            f"Apertura {d['id_apertura']}: acumulado {d['monto_acumulado']} ({d['ventas_acumuladas']} ventas), "
+            f"real {d['monto_real']} ({d['ventas_real']} ventas)"
+        )
+    if not diferencias:
+        click.echo('Totales acumulados correctos.')
+    elif corregir:
+        click.echo(f'{len(diferencias)} aperturas corregidas.')
+    else:
+        click.echo(f'{len(diferencias)} aperturas con diferencias. Use --corregir para repararlas.')
+        raise SystemExit(1)
+
+
+@app.cli.command('migrar')
+@click.option('--baseline', is_flag=True, help='Sólo registrar las migraciones como aplicadas (bases creadas con script.sql)')
+@click.option('--listar', is_flag=True, help='Mostrar el estado de las migraciones sin aplicar nada')
+def migrar(baseline, listar):
+    """Aplica las migraciones pendientes de flask_app/scripts/migraciones."""
+    try:
+        if listar:
+            aplicadas = versiones_aplicadas()
+            for version, nombre, _ in listar_migraciones():
+                click.echo(f"{'[x]' if version in aplicadas else '[ ]'} {version}_{nombre}")
+            return
+        nuevas = aplicar_migraciones(baseline=baseline, echo=click.echo)
+    except DatabaseError as e:
+        raise click.ClickException(f'Error de base de datos: {e}')
+    if not nuevas:
+        click.echo('La base de datos ya está al día.')
+    else:
+        click.echo(f"{len(nuevas)} migraciones {'registradas' if baseline else 'aplicadas'}: {', '.join(nuevas)}")
+
+
+@app.cli.command('verificar-indices')
+@click.option('--min-filas', type=int, default=100, show_default=True, help='Ignorar tablas con menos filas estimadas')
+def verificar_indices(min_filas):
+    """Falla si alguna consulta frecuente recorre una tabla completa (EXPLAIN type = ALL)."""
+    try:
+        problemas = verificar_planes(min_filas=min_filas)
+    except DatabaseError as e:
+        raise click.ClickException(f'Error de base de datos: {e}')
+    if not problemas:
+        click.echo('Todas las consultas frecuentes usan índices.')
+        return
+    for nombre, tabla, filas in problemas:
+        click.echo(f"Full scan en '{nombre}': tabla {tabla} (~{filas} filas)")
+    raise SystemExit(1)
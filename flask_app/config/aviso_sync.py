@@ -0,0 +1,2 @@
+# Ver comun.aviso_sync (compartido con flex_sync_agent.py)
+from comun.aviso_sync import *  # noqa: F401,F403
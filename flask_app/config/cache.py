@@ -0,0 +1,3 @@
+# TTLCache vive en comun.cache para que flex_sync_agent.py la use sin importar
+# flask_app; este módulo mantiene las importaciones de la app.
+from comun.cache import *  # noqa: F401,F403
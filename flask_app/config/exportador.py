@@ -0,0 +1,276 @@
+import csv
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+# Tamaño de los bloques en que se envía el archivo al cliente
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 64 * 1024))
+
+EXPORT_HEADERS = ['FechaHora', 'NroVenta', 'MedioPago', 'Voucher', 'Total']
+EXPORT_COL_WIDTHS = [20, 12, 18, 12, 14]
+
+# Exportaciones por rango de fechas: se generan en segundo plano y quedan en disco
+# hasta EXPORT_JOB_TTL segundos después de terminar.
+EXPORT_DIR = Path(os.environ.get(
+    'EXPORT_DIR',
+    Path(__file__).resolve().parent.parent / 'cache' / 'exports'
+))
+EXPORT_JOB_TTL = float(os.environ.get('EXPORT_JOB_TTL', 3600))
+
+
+def _parse_fecha(fecha_val):
+    if isinstance(fecha_val, str) and fecha_val.strip():
+        try:
+            return datetime.fromisoformat(fecha_val)
+        except Exception:
+            pass
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d-%m-%Y %H:%M:%S", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(fecha_val, fmt)
+            except Exception:
+                continue
+    return fecha_val
+
+
+def fila_export(r, apertura_date=None):
+    """Convierte una fila de vta_ventas (+ medio de pago) en los valores exportados:
+    (FechaHora, NroVenta, MedioPago, Voucher, Total)."""
+    # Determinar la columna de fecha entre las disponibles en la fila
+    fecha_val = (
+        r.get('fecha') or r.get('fecha_venta') or r.get('fecha_creacion') or
+        r.get('created_at') or r.get('timestamp') or r.get('fecha_hora') or r.get('fechaVenta')
+    )
+    # Si no hay fecha en la venta, usar la fecha de la apertura
+    if not fecha_val:
+        fecha_val = apertura_date
+
+    nro = r.get('id_ventas') or r.get('id_venta') or ''
+    medio = r.get('medio_pago') or r.get('tipo_pago') or ''
+    voucher = r.get('voucher') or ''
+    if not voucher or str(voucher).strip() == '0':
+        voucher = ''
+    total = r.get('total_ventas') or r.get('total') or 0
+    return _parse_fecha(fecha_val), nro, medio, voucher, total
+
+
+def _iter_archivo(f):
+    try:
+        while True:
+            chunk = f.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+def _nueva_hoja(wb, title):
+    """Crea una hoja write-only con anchos, panel fijo y encabezado con formato."""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+    from openpyxl.utils import get_column_letter
+
+    ws = wb.create_sheet(title=title)
+
+    # En modo write-only anchos y paneles deben definirse antes de la primera fila
+    for i, w in enumerate(EXPORT_COL_WIDTHS, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = w
+    ws.freeze_panes = 'A2'
+
+    header_font = Font(bold=True, color='FFFFFFFF')
+    header_fill = PatternFill('solid', fgColor='2E8B57')  # verde
+    header_align = Alignment(horizontal='center', vertical='center')
+    thin = Side(border_style='thin', color='FFAAAAAA')
+    header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
+
+    header = []
+    for h in EXPORT_HEADERS:
+        cell = WriteOnlyCell(ws, value=h)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_align
+        cell.border = header_border
+        header.append(cell)
+    ws.append(header)
+    return ws
+
+
+def _agregar_fila(ws, fila):
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment
+
+    fecha, nro, medio, voucher, total = fila
+    fcell = WriteOnlyCell(ws, value=fecha)
+    if fecha and not isinstance(fecha, str):
+        fcell.number_format = 'DD-MM-YYYY HH:MM:SS'
+    tcell = WriteOnlyCell(ws, value=total)
+    tcell.number_format = '#,##0'
+    tcell.alignment = Alignment(horizontal='right')
+    ws.append([fcell, nro, medio, voucher, tcell])
+
+
+def write_xlsx(filas, title):
+    """Escribe `filas` (iterable de tuplas como las de fila_export) en un workbook
+    write-only de openpyxl volcado a un archivo temporal.
+
+    Las filas se serializan a disco a medida que llegan, así la memoria no crece
+    con el tamaño del arqueo. Devuelve (generador de bloques, tamaño en bytes);
+    el archivo temporal se elimina al terminar de recorrer el generador.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = _nueva_hoja(wb, title)
+    row_num = 1
+    for fila in filas:
+        _agregar_fila(ws, fila)
+        row_num += 1
+    ws.auto_filter.ref = f"A1:E{row_num}"
+
+    f = tempfile.TemporaryFile()
+    try:
+        wb.save(f)
+        size = f.tell()
+        f.seek(0)
+    except Exception:
+        f.close()
+        raise
+    return _iter_archivo(f), size
+
+
+def iter_csv(filas, rows_per_chunk=500):
+    """Genera el CSV de `filas` por bloques (separador ';' y BOM para Excel en español)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=';')
+    buf.write('﻿')
+    writer.writerow(EXPORT_HEADERS)
+    pendientes = 0
+    for fecha, nro, medio, voucher, total in filas:
+        if isinstance(fecha, datetime):
+            fecha = fecha.strftime('%d-%m-%Y %H:%M:%S')
+        writer.writerow([fecha or '', nro, medio, voucher, total])
+        pendientes += 1
+        if pendientes >= rows_per_chunk:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate(0)
+            pendientes = 0
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+
+# --- Exportaciones en segundo plano (varias cajas / rango de fechas) ---
+# Pocos workers a propósito: cada trabajo recorre muchas filas de MySQL.
+_export_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('EXPORT_WORKERS', 1)),
+    thread_name_prefix='export'
+)
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _titulo_hoja(nombre, usados):
+    # Excel: máximo 31 caracteres, sin []:*?/\ y sin repetir nombres
+    base = re.sub(r'[\[\]:*?/\\]', ' ', str(nombre)).strip()[:31] or 'Caja'
+    titulo, n = base, 2
+    while titulo in usados:
+        sufijo = f' ({n})'
+        titulo = base[:31 - len(sufijo)] + sufijo
+        n += 1
+    usados.add(titulo)
+    return titulo
+
+
+def _limpiar_exportaciones_vencidas():
+    limite = time.time() - EXPORT_JOB_TTL
+    with _jobs_lock:
+        vencidos = [j for j in _jobs.values() if j['terminado'] and j['terminado'] < limite]
+        for job in vencidos:
+            del _jobs[job['id']]
+    for job in vencidos:
+        if job.get('path'):
+            try:
+                os.remove(job['path'])
+            except OSError:
+                pass
+
+
+def _ejecutar_exportacion(job, filas, nombres_cajas):
+    from openpyxl import Workbook
+
+    job['estado'] = 'procesando'
+    path = EXPORT_DIR / f"{job['id']}.xlsx"
+    tmp_path = path.with_suffix('.xlsx.tmp')
+    try:
+        EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        wb = Workbook(write_only=True)
+        hojas = {}  # id_caja -> (hoja, filas escritas)
+        usados = set()
+        # Las filas llegan ordenadas por caja: cada caja se escribe en su propia hoja
+        for r in filas:
+            id_caja = r.get('id_caja_fk')
+            if id_caja not in hojas:
+                ws = _nueva_hoja(wb, _titulo_hoja(nombres_cajas.get(id_caja, f'Caja {id_caja}'), usados))
+                hojas[id_caja] = [ws, 0]
+            _agregar_fila(hojas[id_caja][0], fila_export(r, r.get('fecha_apertura')))
+            hojas[id_caja][1] += 1
+            job['filas'] += 1
+        if not hojas:
+            _nueva_hoja(wb, 'Sin ventas')
+        for ws, n in hojas.values():
+            ws.auto_filter.ref = f"A1:E{n + 1}"
+        with open(tmp_path, 'wb') as f:
+            wb.save(f)
+        os.replace(tmp_path, path)
+        job['path'] = str(path)
+        job['estado'] = 'listo'
+    except Exception as e:
+        print(f"[EXPORT JOB] {job['id']} falló: {e}")
+        job['estado'] = 'error'
+        job['error'] = str(e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    finally:
+        job['terminado'] = time.time()
+
+
+def iniciar_exportacion(user_id, filas, nombres_cajas, filename):
+    """Encola una exportación XLSX con una hoja por caja y devuelve su id.
+
+    `filas` es un iterable perezoso de filas de venta (con id_caja_fk) ordenadas
+    por caja, p. ej. Venta.iter_for_export; se recorre en el hilo del trabajo.
+    """
+    _limpiar_exportaciones_vencidas()
+    job = {
+        'id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'estado': 'pendiente',  # pendiente | procesando | listo | error
+        'filas': 0,
+        'filename': filename,
+        'path': None,
+        'error': None,
+        'creado': time.time(),
+        'terminado': None,
+    }
+    with _jobs_lock:
+        _jobs[job['id']] = job
+    _export_executor.submit(_ejecutar_exportacion, job, filas, nombres_cajas)
+    return job['id']
+
+
+def get_exportacion(job_id, user_id):
+    """Estado de una exportación; None si no existe o pertenece a otro usuario."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if not job or job['user_id'] != user_id:
+        return None
+    return dict(job)
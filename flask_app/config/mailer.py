@@ -0,0 +1,174 @@
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+from flask_app import app
+from flask_app.models.correo import Correo
+
+
+def send_email(to_address, subject, body, html_body=None, sender=None, attachments=None):
+    """Enviar un email simple usando la configuración en app.config.
+    Lanza excepciones en caso de error para que el llamador las maneje.
+    attachments: lista de dicts con keys 'filename', 'content' (bytes), 'maintype', 'subtype'
+    """
+    # Credenciales SMTP múltiples para balanceo de carga (cPanel)
+    # Cada correo usa su contraseña correspondiente según el índice
+    smtp_users = [
+        "no-responder@clubrecrear.cl",
+        "no-responder1@clubrecrear.cl",
+        "no-responder2@clubrecrear.cl"
+    ]
+    smtp_passwords = [
+        "++&x,TyMji!;",
+        "L7MVjISZvw1t",
+        "3RJC^Of(L_t}"
+    ]
+    
+    # Seleccionar credenciales aleatorias (correo y su contraseña correspondiente por índice)
+    indice = random.randint(0, len(smtp_users) - 1)
+    mail_user = smtp_users[indice]
+    mail_pass = smtp_passwords[indice]
+    
+    mail_server = app.config.get('MAIL_SERVER', 'mail.clubrecrear.cl')
+    mail_port = int(app.config.get('MAIL_PORT', 465) or 465)
+    mail_use_tls = app.config.get('MAIL_USE_TLS', True)
+    mail_use_ssl = app.config.get('MAIL_USE_SSL', False)
+    sender = sender or app.config.get('MAIL_DEFAULT_SENDER', None)
+    # If we have SMTP credentials, prefer using the authenticated user as sender
+    effective_sender = mail_user or sender or f'no-reply@{mail_server}'
+
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = effective_sender
+    msg['To'] = to_address
+    msg.set_content(body)
+    
+    if html_body:
+        msg.add_alternative(html_body, subtype='html')
+
+    if attachments:
+        for att in attachments:
+            msg.add_attachment(
+                att['content'],
+                maintype=att.get('maintype', 'application'),
+                subtype=att.get('subtype', 'octet-stream'),
+                filename=att.get('filename', 'attachment')
+            )
+
+    if app.config.get('LOGIN_DEBUG'):
+        try:
+            print(f"[EMAIL DEBUG] server={mail_server} port={mail_port} use_tls={mail_use_tls} use_ssl={mail_use_ssl} user_set={'yes' if mail_user else 'no'} sender={effective_sender}")
+        except Exception:
+            pass
+
+    if mail_use_ssl:
+        with smtplib.SMTP_SSL(mail_server, mail_port) as server:
+            if mail_user and mail_pass:
+                server.login(mail_user, mail_pass)
+            server.send_message(msg)
+    else:
+        with smtplib.SMTP(mail_server, mail_port) as server:
+            if mail_use_tls:
+                server.starttls()
+            if mail_user and mail_pass:
+                server.login(mail_user, mail_pass)
+            server.send_message(msg)
+
+
+# --- Cola de envío en segundo plano ---
+# Los correos se guardan en `vta_cola_correos` y los envían hilos del proceso
+# web, de modo que un servidor SMTP lento no bloquea la venta en caja.
+# El registro en BD permite reintentar y retomar pendientes tras un reinicio.
+
+MAIL_QUEUE_WORKERS = int(os.environ.get('MAIL_QUEUE_WORKERS', 2))
+MAIL_QUEUE_MAX_INTENTOS = int(os.environ.get('MAIL_QUEUE_MAX_INTENTOS', 5))
+MAIL_QUEUE_POLL = float(os.environ.get('MAIL_QUEUE_POLL', 30))
+
+_mail_queue = queue.Queue()
+_en_proceso = set()
+_en_proceso_lock = threading.Lock()
+_workers_lock = threading.Lock()
+_workers_started = False
+
+
+def enqueue_email(to_address, subject, body, html_body=None, id_venta=None):
+    """Registra el correo en la cola persistente y despierta a los workers.
+    Devuelve True si quedó encolado; False si la cola no está disponible
+    (p. ej. falta la tabla), en cuyo caso el llamador debe enviarlo directamente."""
+    id_correo = Correo.create({
+        'id_venta_fk': id_venta,
+        'destinatario': to_address,
+        'asunto': subject,
+        'cuerpo': body,
+        'cuerpo_html': html_body
+    })
+    if not id_correo:
+        return False
+    start_mail_workers()
+    _mail_queue.put(id_correo)
+    return True
+
+
+def _procesar_correo(id_correo):
+    # El mismo id puede llegar dos veces (push inmediato + poller) o a otro
+    # proceso: sólo lo envía quien lo reclama
+    if not Correo.reclamar(id_correo):
+        return
+    correo = Correo.get_by_id(id_correo)
+    if not correo:
+        return
+    try:
+        send_email(correo.destinatario, correo.asunto, correo.cuerpo, html_body=correo.cuerpo_html)
+        Correo.marcar_enviado(id_correo)
+    except Exception as e:
+        intentos = (correo.intentos or 0) + 1
+        # Backoff cuadrático en minutos: 1, 4, 9, 16...
+        espera = 60 * intentos * intentos if intentos < MAIL_QUEUE_MAX_INTENTOS else None
+        Correo.marcar_fallido(id_correo, e, espera)
+        print(f"[MAIL QUEUE] Error enviando correo {id_correo} (intento {intentos}): {e}")
+
+
+def _worker_loop():
+    while True:
+        id_correo = _mail_queue.get()
+        try:
+            with _en_proceso_lock:
+                if id_correo in _en_proceso:
+                    continue
+                _en_proceso.add(id_correo)
+            try:
+                _procesar_correo(id_correo)
+            finally:
+                with _en_proceso_lock:
+                    _en_proceso.discard(id_correo)
+        except Exception as e:
+            print(f"[MAIL QUEUE] Error inesperado en worker: {e}")
+        finally:
+            _mail_queue.task_done()
+
+
+def _poller_loop():
+    # Retoma los pendientes al iniciar y luego los reintentos cuyo plazo venció
+    while True:
+        try:
+            for id_correo in Correo.get_ids_pendientes():
+                _mail_queue.put(id_correo)
+        except Exception as e:
+            print(f"[MAIL QUEUE] Error consultando pendientes: {e}")
+        time.sleep(MAIL_QUEUE_POLL)
+
+
+def start_mail_workers():
+    """Inicia (una sola vez por proceso) los workers de envío y el poller."""
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        _workers_started = True
+    for i in range(max(1, MAIL_QUEUE_WORKERS)):
+        threading.Thread(target=_worker_loop, name=f'mail-worker-{i}', daemon=True).start()
+    threading.Thread(target=_poller_loop, name='mail-poller', daemon=True).start()
@@ -0,0 +1,140 @@
+import re
+from datetime import date, timedelta
+from pathlib import Path
+
+from flask_app.config.conexiones import connectToMySQL
+
+# Migraciones versionadas: NNNN_descripcion.sql, aplicadas en orden y registradas
+# en vta_migraciones. Cada archivo contiene sentencias separadas por ';' al final
+# de línea; las líneas que empiezan con '--' son comentarios. Las sentencias de un
+# archivo se ejecutan en una misma conexión (pueden usar variables de sesión y
+# PREPARE para cambios condicionales).
+MIGRACIONES_DIR = Path(__file__).resolve().parent.parent / 'scripts' / 'migraciones'
+
+_NOMBRE_MIGRACION = re.compile(r'^(\d{4})_(\w+)\.sql$')
+
+
+def _db():
+    return connectToMySQL('sistemas')
+
+
+def _crear_tabla_migraciones():
+    _db().execute("""
+        CREATE TABLE IF NOT EXISTS vta_migraciones (
+            version VARCHAR(10) NOT NULL,
+            nombre VARCHAR(255) NOT NULL,
+            fecha_aplicacion DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (version)
+        ) ENGINE = InnoDB;
+    """)
+
+
+def listar_migraciones():
+    """Migraciones disponibles en disco como lista de (version, nombre, path), en orden."""
+    migraciones = []
+    for path in sorted(MIGRACIONES_DIR.glob('*.sql')):
+        m = _NOMBRE_MIGRACION.match(path.name)
+        if m:
+            migraciones.append((m.group(1), m.group(2), path))
+    return migraciones
+
+
+def versiones_aplicadas():
+    _crear_tabla_migraciones()
+    return {r['version'] for r in _db().fetch_all("SELECT version FROM vta_migraciones;")}
+
+
+def sentencias(path):
+    """Sentencias SQL de un archivo de migración, sin comentarios."""
+    lineas = [l for l in Path(path).read_text(encoding='utf-8').splitlines() if not l.lstrip().startswith('--')]
+    return [s.strip() for s in re.split(r';\s*(?:\n|$)', '\n'.join(lineas)) if s.strip()]
+
+
+def aplicar_migraciones(baseline=False, echo=print):
+    """Aplica en orden las migraciones pendientes y devuelve las versiones aplicadas.
+
+    Con `baseline=True` sólo las registra como aplicadas (bases creadas con
+    script.sql, que ya incluye todas). MySQL confirma cada DDL de inmediato: si
+    una sentencia falla, la migración queda sin registrar y el error se propaga
+    para corregirla a mano antes de reintentar.
+    """
+    aplicadas = versiones_aplicadas()
+    nuevas = []
+    for version, nombre, path in listar_migraciones():
+        if version in aplicadas:
+            continue
+        if not baseline:
+            echo(f"Aplicando {version}_{nombre}...")
+            with _db().transaction() as cursor:
+                for sql in sentencias(path):
+                    cursor.execute(sql)
+        _db().execute(
+            "INSERT INTO vta_migraciones (version, nombre) VALUES (%(version)s, %(nombre)s);",
+            {'version': version, 'nombre': nombre}
+        )
+        nuevas.append(version)
+    return nuevas
+
+
+# --- Verificación de planes de ejecución ---
+# Consultas frecuentes de la app y del agente, con parámetros de ejemplo. Si
+# alguna pasa a recorrer una tabla completa (EXPLAIN type = ALL) la verificación
+# falla: suele indicar un índice faltante o una condición que dejó de ser sargable.
+# Las consultas con constructor propio se arman con él, no con una copia del SQL,
+# para que la verificación siga a la query que la app ejecuta realmente.
+def _consultas_frecuentes():
+    # Importaciones diferidas: los modelos importan este paquete y el agente es un script aparte
+    from flask_app.models.apertura import Apertura
+    from flask_app.models.venta import Venta
+    from flask_app.models.correo import Correo
+    from flex_sync_agent import FlexSyncAgent
+
+    hoy = date.today()
+    agente = FlexSyncAgent
+    columnas_agente = agente.PENDING_COLUMNS + ", intentos_correo"
+    return [
+        ('apertura activa por caja',
+         "SELECT * FROM vta_apertura WHERE id_caja_fk = %s AND estado_apertura = 1 LIMIT 1;",
+         (1,)),
+        ('listado paginado de aperturas',
+         *Apertura.page_query([1, 2])),
+        ('listado paginado de aperturas (página siguiente, con fechas)',
+         *Apertura.page_query([1, 2], cursor=(hoy, 1000), desde=hoy - timedelta(days=30), hasta=hoy)),
+        ('totales por apertura',
+         "SELECT id_apertura, IFNULL(SUM(total_ventas),0) AS total FROM vta_ventas "
+         "WHERE id_apertura IN (%s, %s) GROUP BY id_apertura;",
+         (1, 2)),
+        ('ventas pendientes del agente',
+         agente.pending_page_query(agente.PENDING_WHERE, columnas_agente),
+         (0, agente.BATCH_SIZE)),
+        ('conteo de ventas pendientes del agente',
+         agente.pending_count_query(),
+         None),
+        ('boletas emitidas con correo pendiente',
+         agente.pending_page_query(agente.EMITIDAS_WHERE, columnas_agente),
+         (0, agente.BATCH_SIZE)),
+        ('cliente por email',
+         "SELECT id_cliente FROM vta_clientes WHERE email_cliente = %s;",
+         ('cliente@ejemplo.cl',)),
+        ('exportación por rango de fechas',
+         *Venta.export_query([1, 2], hoy - timedelta(days=30), hoy)),
+        ('cola de correos pendientes',
+         Correo.PENDIENTES_QUERY,
+         {'limit': 100}),
+    ]
+
+
+def verificar_planes(min_filas=100):
+    """Ejecuta EXPLAIN sobre las consultas frecuentes.
+
+    Devuelve una lista de (nombre, tabla, filas estimadas) con los recorridos
+    completos encontrados. Se ignoran tablas con menos de `min_filas` filas
+    estimadas, donde un full scan es lo más barato y MySQL lo elige a propósito.
+    """
+    problemas = []
+    for nombre, query, params in _consultas_frecuentes():
+        for fila in _db().fetch_all(f"EXPLAIN {query}", params):
+            tabla = fila.get('table') or ''
+            if fila.get('type') == 'ALL' and not tabla.startswith('<') and int(fila.get('rows') or 0) >= min_filas:
+                problemas.append((nombre, tabla, int(fila.get('rows') or 0)))
+    return problemas
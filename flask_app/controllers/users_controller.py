@@ -1,13 +1,12 @@
-import smtplib
 import json
 import requests
 import pprint
-import random
+import hmac
+import os
 from decimal import Decimal
-from email.message import EmailMessage
 from datetime import datetime
 
-from flask import render_template, redirect, request, session, flash, url_for, jsonify, Response
+from flask import render_template, redirect, request, session, flash, url_for, jsonify, Response, g, send_file
 from flask_bcrypt import Bcrypt
 
 from flask_app import app
@@ -17,7 +16,11 @@ from flask_app.models.cajas import Caja
 from flask_app.models.apertura import Apertura
 from flask_app.models.venta import Venta
 from flask_app.models.permiso import Permiso
-from flask_app.config.conexiones import connectToMySQL
+from flask_app.models.correo import Correo
+from flask_app.config.conexiones import connectToMySQL, release_request_connections
+from flask_app.config.cache import TTLCache
+from flask_app.config.mailer import send_email, enqueue_email
+from flask_app.config.exportador import fila_export, write_xlsx, iter_csv, iniciar_exportacion, get_exportacion
 
 bcrypt = Bcrypt(app)
 
@@ -49,73 +52,52 @@ def validar_rut(rut):
     return dv == dv_esperado
 
 
-def send_email(to_address, subject, body, html_body=None, sender=None, attachments=None):
-    """Enviar un email simple usando la configuración en app.config.
-    Lanza excepciones en caso de error para que el llamador las maneje.
-    attachments: lista de dicts con keys 'filename', 'content' (bytes), 'maintype', 'subtype'
-    """
-    # Credenciales SMTP múltiples para balanceo de carga (cPanel)
-    # Cada correo usa su contraseña correspondiente según el índice
-    smtp_users = [
-        "no-responder@clubrecrear.cl",
-        "no-responder1@clubrecrear.cl",
-        "no-responder2@clubrecrear.cl"
-    ]
-    smtp_passwords = [
-        "++&x,TyMji!;",
-        "L7MVjISZvw1t",
-        "3RJC^Of(L_t}"
-    ]
-    
-    # Seleccionar credenciales aleatorias (correo y su contraseña correspondiente por índice)
-    indice = random.randint(0, len(smtp_users) - 1)
-    mail_user = smtp_users[indice]
-    mail_pass = smtp_passwords[indice]
-    
-    mail_server = app.config.get('MAIL_SERVER', 'mail.clubrecrear.cl')
-    mail_port = int(app.config.get('MAIL_PORT', 465) or 465)
-    mail_use_tls = app.config.get('MAIL_USE_TLS', True)
-    mail_use_ssl = app.config.get('MAIL_USE_SSL', False)
-    sender = sender or app.config.get('MAIL_DEFAULT_SENDER', None)
-    # If we have SMTP credentials, prefer using the authenticated user as sender
-    effective_sender = mail_user or sender or f'no-reply@{mail_server}'
-
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = effective_sender
-    msg['To'] = to_address
-    msg.set_content(body)
-    
-    if html_body:
-        msg.add_alternative(html_body, subtype='html')
-
-    if attachments:
-        for att in attachments:
-            msg.add_attachment(
-                att['content'],
-                maintype=att.get('maintype', 'application'),
-                subtype=att.get('subtype', 'octet-stream'),
-                filename=att.get('filename', 'attachment')
-            )
+# --- Contexto del usuario logueado ---
+# Usuario, cajas permitidas y listado de cajas se resuelven una vez por request
+# (flask.g) y se cachean unos segundos entre requests para no repetir las mismas
+# consultas en cada página. Un cambio de permisos se refleja al vencer el TTL o
+# de inmediato con invalidar_contexto_usuario(). Los loaders propagan DatabaseError:
+# un error de BD nunca se cachea como "sin permisos" o "sin cajas".
+_user_context_cache = TTLCache(ttl=float(os.environ.get('USER_CONTEXT_TTL', 60)), max_size=1024)
 
-    if app.config.get('LOGIN_DEBUG'):
-        try:
-            print(f"[EMAIL DEBUG] server={mail_server} port={mail_port} use_tls={mail_use_tls} use_ssl={mail_use_ssl} user_set={'yes' if mail_user else 'no'} sender={effective_sender}")
-        except Exception:
-            pass
 
-    if mail_use_ssl:
-        with smtplib.SMTP_SSL(mail_server, mail_port) as server:
-            if mail_user and mail_pass:
-                server.login(mail_user, mail_pass)
-            server.send_message(msg)
-    else:
-        with smtplib.SMTP(mail_server, mail_port) as server:
-            if mail_use_tls:
-                server.starttls()
-            if mail_user and mail_pass:
-                server.login(mail_user, mail_pass)
-            server.send_message(msg)
+def _contexto_cacheado(key, loader):
+    por_request = g.setdefault('user_context', {})
+    if key in por_request:
+        return por_request[key]
+    value = _user_context_cache.get(key)
+    if value is None:
+        value = loader()  # DatabaseError se propaga sin cachear nada
+        _user_context_cache.set(key, value)
+    por_request[key] = value
+    return value
+
+
+def get_current_user():
+    user_id = session['user_id']
+    return _contexto_cacheado(('user', user_id), lambda: User.get_by_id(user_id))
+
+
+def get_allowed_caja_ids():
+    user_id = session['user_id']
+    return _contexto_cacheado(
+        ('cajas_permitidas', user_id),
+        lambda: [p.vta_cajas_id_caja for p in Permiso.get_by_user_id(user_id)]
+    )
+
+
+def get_all_cajas():
+    return _contexto_cacheado(('cajas',), Caja.get_all)
+
+
+def invalidar_contexto_usuario(user_id=None):
+    """Descarta usuario y permisos cacheados de un usuario (o de todos) y el listado de cajas."""
+    if user_id is None:
+        _user_context_cache.invalidate()
+        return
+    _user_context_cache.invalidate(('user', user_id))
+    _user_context_cache.invalidate(('cajas_permitidas', user_id))
+    _user_context_cache.invalidate(('cajas',))
 
 # --- Rutas ---
 
@@ -174,6 +156,8 @@ def login():
         return redirect('/')
         
     session['user_id'] = user.id_usuario
+    # Un nuevo inicio de sesión siempre parte con permisos frescos
+    invalidar_contexto_usuario(user.id_usuario)
     return redirect('/index.html')
 
 @app.route('/index.html')
@@ -181,12 +165,11 @@ def index_html():
     if 'user_id' not in session:
         return redirect('/')
     
-    user = User.get_by_id(session['user_id'])
+    user = get_current_user()
     
-    permisos = Permiso.get_by_user_id(session['user_id'])
-    allowed_caja_ids = [p.vta_cajas_id_caja for p in permisos]
+    allowed_caja_ids = get_allowed_caja_ids()
     
-    cajas = Caja.get_all()
+    cajas = get_all_cajas()
     allowed_cajas = [c for c in cajas if c.id_caja in allowed_caja_ids]
     # if app.config.get('LOGIN_DEBUG'):
     #     try:
@@ -214,7 +197,7 @@ def ver_caja(id_caja):
     is_variable = current_caja.es_variable if current_caja else 0
     
     productos = Producto.get_by_caja(id_caja)
-    cajas = Caja.get_all()
+    cajas = get_all_cajas()
     # Apertura activa (por caja)
     active_apertura = Apertura.get_active_by_caja(id_caja)
     apertura_totals = 0
@@ -225,8 +208,7 @@ def ver_caja(id_caja):
             apertura_totals = 0
     # Permisos del usuario sobre cajas (para mostrar mensajes útiles)
     try:
-        permisos = Permiso.get_by_user_id(session['user_id'])
-        allowed_caja_ids = [p.vta_cajas_id_caja for p in permisos]
+        allowed_caja_ids = get_allowed_caja_ids()
     except Exception:
         allowed_caja_ids = []
     can_open_apertura = (id_caja in allowed_caja_ids)
@@ -245,74 +227,74 @@ def ver_caja(id_caja):
     return render_template('caja.html', productos=productos, id_caja=id_caja, cajas=cajas, apertura=active_apertura, apertura_totals=apertura_totals, can_open_apertura=can_open_apertura, current_caja=current_caja, is_variable=is_variable)
 
 
+APERTURAS_PAGE_SIZE = int(os.environ.get('APERTURAS_PAGE_SIZE', 50))
+APERTURAS_PAGE_SIZE_MAX = 200
+
+
+def _filtros_aperturas(allowed_caja_ids):
+    """Lee los filtros del listado de aperturas desde la query string.
+    Lanza ValueError si algún parámetro es inválido."""
+    caja = request.args.get('caja', type=int)
+    if caja is not None and caja not in allowed_caja_ids:
+        raise ValueError('caja')
+    desde = request.args.get('desde') or None
+    hasta = request.args.get('hasta') or None
+    cursor = request.args.get('cursor') or None
+    limite = request.args.get('limite', APERTURAS_PAGE_SIZE, type=int)
+    return {
+        'caja_ids': [caja] if caja is not None else allowed_caja_ids,
+        'desde': datetime.strptime(desde, '%Y-%m-%d').date() if desde else None,
+        'hasta': datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else None,
+        'cursor': Apertura.decode_cursor(cursor) if cursor else None,
+        'limit': max(1, min(limite, APERTURAS_PAGE_SIZE_MAX)),
+    }
+
+
 @app.route('/aperturas')
 def listar_aperturas():
     if 'user_id' not in session:
         return redirect('/')
 
-    permisos = Permiso.get_by_user_id(session['user_id'])
-    allowed_caja_ids = [p.vta_cajas_id_caja for p in permisos]
-    # obtener aperturas para las cajas permitidas
+    allowed_caja_ids = get_allowed_caja_ids()
     try:
-        aperturas = Apertura.get_all_by_cajas(allowed_caja_ids)
+        filtros = _filtros_aperturas(allowed_caja_ids)
+    except ValueError:
+        flash('Filtros inválidos, se muestra el listado completo.', 'warning')
+        return redirect(url_for('listar_aperturas'))
+
+    # obtener una página de aperturas para las cajas permitidas
+    next_cursor = None
+    try:
+        aperturas, next_cursor = Apertura.get_page_by_cajas(**filtros)
     except Exception as e:
         if app.config.get('LOGIN_DEBUG'):
             print(f"[APERTURAS DEBUG] Error obteniendo aperturas: {e}")
         aperturas = []
 
     # obtener información de cajas para mostrar el nombre
-    all_cajas = Caja.get_all()
+    all_cajas = get_all_cajas()
     cajas = {c.id_caja: c for c in all_cajas}
     # cajas permitidas para este usuario
     allowed_cajas = [c for c in all_cajas if c.id_caja in allowed_caja_ids]
 
-    # calcular totales de ventas por apertura para mostrar en la tabla
-    totals_map = {}
+    # calcular totales de ventas por apertura para mostrar en la tabla (una sola consulta agrupada)
     try:
-        for ap in aperturas:
-            try:
-                totals_map[ap.id_apertura] = Apertura.get_totals_for_apertura(ap.id_apertura)
-            except Exception:
-                totals_map[ap.id_apertura] = 0
+        totals_map = Apertura.get_totals_for_aperturas([ap.id_apertura for ap in aperturas])
     except Exception:
         totals_map = {}
 
     # --- KPIs para los chips (ventas del día, total del día, arqueos abiertos, último arqueo) ---
-    ventas_count = 0
-    ventas_total_hoy = 0
-    arqueos_abiertos_count = 0
-    ultimo_arqueo_creado = None
-
     try:
-        if allowed_caja_ids:
-            placeholders = ','.join(['%s'] * len(allowed_caja_ids))
-            # Contar ventas del día (usamos la fecha de la apertura asociada como aproximación)
-            q_ventas = (
-                f"SELECT COUNT(v.id_ventas) AS cnt, IFNULL(SUM(v.total_ventas),0) AS total "
-                f"FROM vta_ventas v JOIN vta_apertura a ON v.id_apertura = a.id_apertura "
-                f"WHERE a.id_caja_fk IN ({placeholders}) AND DATE(a.fecha_inicio_apertura) = CURDATE();"
-            )
-            res_v = connectToMySQL('sistemas').query_db(q_ventas, tuple(allowed_caja_ids))
-            if res_v and isinstance(res_v, list) and len(res_v) > 0:
-                ventas_count = int(res_v[0].get('cnt', 0) or 0)
-                ventas_total_hoy = int(res_v[0].get('total', 0) or 0)
-
-            # contar aperturas abiertas para esas cajas
-            q_abiertos = f"SELECT COUNT(*) AS cnt FROM vta_apertura WHERE estado_apertura = 1 AND id_caja_fk IN ({placeholders});"
-            res_a = connectToMySQL('sistemas').query_db(q_abiertos, tuple(allowed_caja_ids))
-            if res_a and isinstance(res_a, list) and len(res_a) > 0:
-                arqueos_abiertos_count = int(res_a[0].get('cnt', 0) or 0)
-
-            # obtener la fecha del último arqueo creado (más reciente fecha_inicio_apertura)
-            q_ultimo = f"SELECT fecha_inicio_apertura FROM vta_apertura WHERE id_caja_fk IN ({placeholders}) ORDER BY fecha_inicio_apertura DESC LIMIT 1;"
-            res_u = connectToMySQL('sistemas').query_db(q_ultimo, tuple(allowed_caja_ids))
-            if res_u and isinstance(res_u, list) and len(res_u) > 0:
-                ultimo_arqueo_creado = res_u[0].get('fecha_inicio_apertura')
+        kpis = Apertura.get_kpis_for_cajas(allowed_caja_ids)
     except Exception as e:
         if app.config.get('LOGIN_DEBUG'):
             print(f"[APERTURAS KPI DEBUG] Error calculando KPIs: {e}")
+        kpis = {'ventas_count': 0, 'ventas_total_hoy': 0, 'arqueos_abiertos_count': 0, 'ultimo_arqueo_creado': None}
 
-    most_recent = aperturas[0] if aperturas else None
+    # La tarjeta de última actividad sólo tiene sentido en la primera página
+    most_recent = aperturas[0] if aperturas and not filtros['cursor'] else None
+    # Filtros vigentes, para el formulario y el enlace a la página siguiente
+    filtros_activos = {k: request.args.get(k) for k in ('caja', 'desde', 'hasta') if request.args.get(k)}
     # Si venimos de cerrar una apertura, se guarda en session para mostrar el resumen modal
     apertura_resumen_id = None
     try:
@@ -320,7 +302,58 @@ def listar_aperturas():
     except Exception:
         apertura_resumen_id = None
 
-    return render_template('aperturas.html', aperturas=aperturas, cajas=cajas, totals_map=totals_map, allowed_cajas=allowed_cajas, most_recent=most_recent, apertura_resumen_id=apertura_resumen_id, ventas_count=ventas_count, arqueos_abiertos_count=arqueos_abiertos_count, ultimo_arqueo_creado=ultimo_arqueo_creado)
+    return render_template('aperturas.html', aperturas=aperturas, cajas=cajas, totals_map=totals_map, allowed_cajas=allowed_cajas, most_recent=most_recent, apertura_resumen_id=apertura_resumen_id, kpis=kpis, next_cursor=next_cursor, filtros_activos=filtros_activos)
+
+
+@app.route('/api/aperturas/kpis')
+def api_aperturas_kpis():
+    """KPIs del panel de aperturas en JSON (la página los consulta periódicamente)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'not_authenticated'}), 401
+
+    try:
+        kpis = Apertura.get_kpis_for_cajas(get_allowed_caja_ids())
+    except Exception as e:
+        if app.config.get('LOGIN_DEBUG'):
+            print(f"[API DEBUG] Error calculando KPIs: {e}")
+        return jsonify({'error': 'internal_error'}), 500
+
+    ultimo = kpis.get('ultimo_arqueo_creado')
+    kpis['ultimo_arqueo_creado'] = ultimo.isoformat() if ultimo else None
+    return jsonify(kpis)
+
+
+@app.route('/api/aperturas')
+def api_aperturas():
+    """Endpoint JSON del listado de aperturas (mismos filtros y cursor que /aperturas)."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'not_authenticated'}), 401
+
+    try:
+        filtros = _filtros_aperturas(get_allowed_caja_ids())
+    except ValueError:
+        return jsonify({'error': 'invalid_filters'}), 400
+
+    try:
+        aperturas, next_cursor = Apertura.get_page_by_cajas(**filtros)
+        totals_map = Apertura.get_totals_for_aperturas([ap.id_apertura for ap in aperturas])
+    except Exception as e:
+        if app.config.get('LOGIN_DEBUG'):
+            print(f"[API DEBUG] Error obteniendo aperturas: {e}")
+        return jsonify({'error': 'internal_error'}), 500
+
+    items = []
+    for ap in aperturas:
+        items.append({
+            'id_apertura': ap.id_apertura,
+            'id_caja': ap.id_caja_fk,
+            'estado_apertura': ap.estado_apertura,
+            'fecha_inicio_apertura': ap.fecha_inicio_apertura.isoformat() if ap.fecha_inicio_apertura else None,
+            'fecha_termino_apertura': ap.fecha_termino_apertura.isoformat() if ap.fecha_termino_apertura else None,
+            'total_ventas': totals_map.get(ap.id_apertura, 0),
+        })
+
+    return Response(json.dumps({'aperturas': items, 'next_cursor': next_cursor}, default=decimal_default), mimetype='application/json')
 
 
 @app.route('/api/caja/<int:id_caja>/productos')
@@ -349,6 +382,40 @@ def api_productos_por_caja(id_caja):
 
     return jsonify(productos_json)
 
+
+def _admin_token_valido():
+    """True si el request trae el token de administración (header X-Admin-Token)."""
+    expected = app.config.get('ADMIN_TOKEN')
+    provided = request.headers.get('X-Admin-Token')
+    return bool(expected and provided and hmac.compare_digest(expected, provided))
+
+
+@app.route('/api/usuarios/contexto/invalidar', methods=['POST'])
+@app.route('/api/usuarios/<int:user_id>/contexto/invalidar', methods=['POST'])
+def api_invalidar_contexto_usuario(user_id=None):
+    """Descarta permisos/usuario cacheados tras un cambio de permisos (sólo con X-Admin-Token)."""
+    if not _admin_token_valido():
+        return jsonify({'error': 'not_authenticated'}), 401
+
+    invalidar_contexto_usuario(user_id)
+    return jsonify({'ok': True, 'user_id': user_id})
+
+
+@app.route('/api/productos/invalidar', methods=['POST'])
+@app.route('/api/caja/<int:id_caja>/productos/invalidar', methods=['POST'])
+def api_invalidar_catalogo(id_caja=None):
+    """Descarta el catálogo cacheado de una caja (o de todas) para forzar su recarga.
+    Con X-Admin-Token se puede invalidar cualquier caja o todas; un usuario con
+    sesión sólo las cajas que tiene permitidas, de a una."""
+    if not _admin_token_valido():
+        if 'user_id' not in session:
+            return jsonify({'error': 'not_authenticated'}), 401
+        if id_caja is None or id_caja not in get_allowed_caja_ids():
+            return jsonify({'error': 'forbidden_caja'}), 403
+
+    Producto.invalidate_cache(id_caja)
+    return jsonify({'ok': True, 'id_caja': id_caja})
+
 @app.route('/pago', methods=['POST'])
 def resumen_pago():
     if 'user_id' not in session:
@@ -451,8 +518,7 @@ def apertura_crear():
 
     # Verificar permisos del usuario para la caja solicitada
     try:
-        permisos = Permiso.get_by_user_id(session['user_id'])
-        allowed_caja_ids = [p.vta_cajas_id_caja for p in permisos]
+        allowed_caja_ids = get_allowed_caja_ids()
     except Exception:
         allowed_caja_ids = []
 
@@ -562,6 +628,8 @@ def resumen_apertura_fragment(id_apertura):
 
 @app.route('/logout')
 def logout():
+    if 'user_id' in session:
+        invalidar_contexto_usuario(session['user_id'])
     session.clear()
     return redirect('/')
 
@@ -629,8 +697,7 @@ def datos_cliente():
                 return redirect(url_for('ver_caja', id_caja=int(id_caja)))
 
             # Verificar que el usuario tenga permiso para operar en esta caja
-            permisos = Permiso.get_by_user_id(session['user_id'])
-            allowed_caja_ids = [p.vta_cajas_id_caja for p in permisos]
+            allowed_caja_ids = get_allowed_caja_ids()
             if id_caja_int not in allowed_caja_ids:
                 flash('No tienes permiso para operar en esa caja.', 'danger')
                 return redirect(url_for('ver_caja', id_caja=id_caja_int))
@@ -688,29 +755,24 @@ def datos_cliente():
                 'envio_boleta': 0         # Valor por defecto
             }
 
-            id_venta = Venta.create(data_venta, productos_list)
+            # 4. Medio de pago (vta_mediopago), registrado en la misma transacción que la venta
+            medio = cliente_temp.get('medio_pago') or request.form.get('medio_pago')
+            voucher_val = cliente_temp.get('voucher') or request.form.get('voucher')
+            id_voucher_val = 0  # Inicializar por defecto para evitar UnboundLocalError
+            if medio:
+                try:
+                    id_voucher_val = int(voucher_val) if voucher_val is not None and str(voucher_val).strip() != '' else 0
+                except Exception:
+                    id_voucher_val = 0
+
+            id_venta = Venta.create(data_venta, productos_list, medio_pago={'tipo': medio, 'id_voucher': id_voucher_val})
 
             if not id_venta:
                 flash('Hubo un error al registrar la venta en la base de datos.', 'danger')
                 return redirect(url_for('ver_caja', id_caja=int(id_caja)))
 
-            # 4. Registrar medio de pago en vta_mediopago
-            medio = cliente_temp.get('medio_pago') or request.form.get('medio_pago')
-            voucher_val = cliente_temp.get('voucher') or request.form.get('voucher')
-            id_voucher_val = 0  # Inicializar por defecto para evitar UnboundLocalError
-            
-            try:
-                if medio:
-                    try:
-                        id_voucher_val = int(voucher_val) if voucher_val is not None and str(voucher_val).strip() != '' else 0
-                    except Exception:
-                        id_voucher_val = 0
-
-                    mp_q = "INSERT INTO vta_mediopago (tipo_pago, id_voucher, id_ventas_fk) VALUES (%(tipo)s, %(id_voucher)s, %(id_venta)s)"
-                    connectToMySQL('sistemas').query_db(mp_q, {'tipo': medio, 'id_voucher': id_voucher_val, 'id_venta': id_venta})
-            except Exception as e:
-                if app.config.get('LOGIN_DEBUG'):
-                    print(f"[PAYMENT DEBUG] Error insertando medio de pago: {e}")
+            # Lo que sigue (Factura X, correo) no usa la conexión del request: devolverla al pool
+            release_request_connections()
 
             # flash(f'Venta #{id_venta} registrada con éxito!', 'success')
 
@@ -852,8 +914,10 @@ def datos_cliente():
                         print(f"[FACTURA-X EXCEPTION] {e}")
 
             # Enviar Correo automáticamente si existe correo_cli
-            # Solo envía comprobante de pago, el agente enviará la boleta después
+            # Solo envía comprobante de pago, el agente enviará la boleta después.
+            # El envío se encola: la venta no espera al servidor SMTP.
             email_sent = False
+            email_queued = False
             email_error = None
             if correo_cli:
                 try:
@@ -896,10 +960,12 @@ def datos_cliente():
                     # NO adjuntar PDF - el agente lo enviará después
                     attachments_list = []
 
-                    # Enviar usando la función auxiliar send_email (solo comprobante)
-                    send_email(correo_cli, subject, body, html_body=html_body, attachments=attachments_list)
-                    
-                    email_sent = True
+                    email_queued = enqueue_email(correo_cli, subject, body, html_body=html_body, id_venta=id_venta)
+                    if not email_queued:
+                        # Cola no disponible: enviar en línea usando la función auxiliar send_email (solo comprobante)
+                        release_request_connections()
+                        send_email(correo_cli, subject, body, html_body=html_body, attachments=attachments_list)
+                        email_sent = True
                     # flash(f'Comprobante de compra enviado a {correo_cli}', 'success')
 
                 except Exception as e:
@@ -939,6 +1005,7 @@ def datos_cliente():
                 'productos': productos_list,
                 'cliente': cliente_info,
                 'email_sent': email_sent,
+                'email_queued': email_queued,
                 'email_error': email_error
             }
         except Exception as e:
@@ -953,6 +1020,7 @@ def datos_cliente():
                 'productos': productos_list,
                 'cliente': {'nombre': nombre_cli, 'correo': correo_cli},
                 'email_sent': email_sent,
+                'email_queued': email_queued,
                 'email_error': email_error
             }
 
@@ -979,14 +1047,34 @@ def datos_cliente():
 
     return render_template('procesamiento_pago.html', id_caja=id_caja, productos=productos, total=total)
 
+@app.route('/api/venta/<int:id_venta>/correo')
+def api_estado_correo_venta(id_venta):
+    """Estado del comprobante por correo de una venta (pendiente | enviando | enviado | error).
+    Sólo para ventas de las cajas del usuario."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'not_authenticated'}), 401
+
+    correo = Correo.get_ultimo_by_venta(id_venta, get_allowed_caja_ids())
+    if not correo:
+        return jsonify({'estado': None}), 404
+    return jsonify({
+        'estado': correo.estado,
+        'intentos': correo.intentos,
+        'error': correo.ultimo_error,
+    })
+
 # La ruta /confirmar_pago fue eliminada: el flujo ahora procesa la venta directamente
 # desde /datos_cliente (POST) y renderiza `comprobante.html`.
 
 
 @app.route('/apertura/<int:id_apertura>/export')
 def export_apertura_xlsx(id_apertura):
-    """Exportar las ventas de una apertura como archivo Excel (.xlsx) con formato.
+    """Exportar las ventas de una apertura como archivo Excel (.xlsx) con formato,
+    o como CSV con ?formato=csv (recomendado para rangos muy grandes).
     Columnas: FechaHora, NroVenta, MedioPago, Voucher, Total
+
+    Ambos formatos se envían por bloques: el .xlsx se genera en modo write-only
+    sobre un archivo temporal y el CSV se produce fila a fila.
     """
     if 'user_id' not in session:
         return redirect('/')
@@ -1000,25 +1088,20 @@ def export_apertura_xlsx(id_apertura):
         "LEFT JOIN vta_mediopago mp ON mp.id_ventas_fk = v.id_ventas "
         "WHERE v.id_apertura = %(id_apertura)s ORDER BY v.id_ventas ASC;"
     )
-    rows = connectToMySQL('sistemas').query_db(q, {'id_apertura': id_apertura})
+    # Las filas se leen en streaming (cursor del servidor) y se van escribiendo,
+    # así la memoria no depende del tamaño del arqueo.
+    rows = connectToMySQL('sistemas').iter_query(q, {'id_apertura': id_apertura})
 
-    # Debug logging to diagnose empty exports. Prints SQL, apertura id and row count.
-    try:
+    def _filas_con_log(rows):
+        # Log para diagnosticar exportaciones vacías: cantidad de filas (y muestra en LOGIN_DEBUG)
+        cnt = 0
         try:
-            cnt = len(rows) if rows is not None else 0
-        except Exception:
-            cnt = 'unknown'
-        if app.config.get('LOGIN_DEBUG'):
-            print(f"[EXPORT XLSX DEBUG] id_apertura={id_apertura} rows_returned={cnt}")
-            try:
-                print(f"[EXPORT XLSX DEBUG] sample_rows={rows[:3]}")
-            except Exception:
-                pass
-        else:
-            # Lightweight informational print to help the user when they run the server.
+            for cnt, r in enumerate(rows, 1):
+                if cnt <= 3 and app.config.get('LOGIN_DEBUG'):
+                    print(f"[EXPORT XLSX DEBUG] sample_row={r}")
+                yield r
+        finally:
             print(f"[EXPORT XLSX] id_apertura={id_apertura} rows_returned={cnt}")
-    except Exception:
-        pass
 
     # Obtener la fecha de la apertura para usarla como fallback si la venta no tiene fecha
     try:
@@ -1027,99 +1110,91 @@ def export_apertura_xlsx(id_apertura):
     except Exception:
         apertura_date = None
 
-    # Crear workbook en memoria usando openpyxl
+    filas = (fila_export(r, apertura_date) for r in _filas_con_log(rows))
+    # iter_query usa su propia conexión: la del request no hace falta mientras se genera el archivo
+    release_request_connections()
+
+    if request.args.get('formato') == 'csv':
+        resp = Response(iter_csv(filas), mimetype='text/csv; charset=utf-8')
+        resp.headers['Content-Disposition'] = f'attachment; filename="arqueo_{id_apertura}.csv"'
+        return resp
+
     try:
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        from openpyxl.utils import get_column_letter
-    except Exception:
+        chunks, size = write_xlsx(filas, f"Arqueo {id_apertura}")
+    except ImportError:
         flash('Dependency missing: openpyxl no está instalado. Instale la dependencia y reinicie.', 'danger')
         return redirect(url_for('resumen_apertura', id_apertura=id_apertura))
+    except Exception as e:
+        print(f"[EXPORT XLSX] Error exportando apertura {id_apertura}: {e}")
+        flash('No se pudo generar la exportación.', 'danger')
+        return redirect(url_for('resumen_apertura', id_apertura=id_apertura))
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = f"Arqueo {id_apertura}"
-
-    headers = ['FechaHora', 'NroVenta', 'MedioPago', 'Voucher', 'Total']
-    header_font = Font(bold=True, color='FFFFFFFF')
-    header_fill = PatternFill('solid', fgColor='2E8B57')  # verde
-    header_align = Alignment(horizontal='center', vertical='center')
-    thin = Side(border_style='thin', color='FFAAAAAA')
-    header_border = Border(left=thin, right=thin, top=thin, bottom=thin)
-
-    for col_idx, h in enumerate(headers, start=1):
-        cell = ws.cell(row=1, column=col_idx, value=h)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_align
-        cell.border = header_border
-
-    # Escribir filas
-    row_num = 2
-    for r in rows or []:
-        # Determine a sensible date field from available columns returned by DB.
-        fecha_val = (
-            r.get('fecha') or r.get('fecha_venta') or r.get('fecha_creacion') or
-            r.get('created_at') or r.get('timestamp') or r.get('fecha_hora') or r.get('fechaVenta')
-        )
-
-        # Si no hay fecha en la venta, usar la fecha de la apertura (requerimiento solicitado)
-        if not fecha_val:
-            fecha_val = apertura_date
-        # Parsear string a datetime si es necesario
-        if isinstance(fecha_val, str) and fecha_val.strip():
-            try:
-                from datetime import datetime as _dt
-                try:
-                    fecha_dt = _dt.fromisoformat(fecha_val)
-                except Exception:
-                    fecha_dt = None
-                if fecha_dt is None:
-                    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d-%m-%Y %H:%M:%S", "%Y-%m-%d"):
-                        try:
-                            fecha_dt = _dt.strptime(fecha_val, fmt)
-                            break
-                        except Exception:
-                            fecha_dt = None
-                if fecha_dt:
-                    fecha_val = fecha_dt
-            except Exception:
-                pass
+    filename = f"arqueo_{id_apertura}.xlsx"
+    resp = Response(chunks, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    resp.headers['Content-Length'] = str(size)
+    return resp
 
-        nro = r.get('id_ventas') or r.get('id_venta') or ''
-        medio = r.get('medio_pago') or r.get('tipo_pago') or ''
-        voucher = r.get('voucher') or ''
-        if not voucher or str(voucher).strip() == '0':
-            voucher = ''
-        total = r.get('total_ventas') or r.get('total') or 0
 
-        fcell = ws.cell(row=row_num, column=1, value=fecha_val)
-        ws.cell(row=row_num, column=2, value=nro)
-        ws.cell(row=row_num, column=3, value=medio)
-        ws.cell(row=row_num, column=4, value=voucher)
-        tcell = ws.cell(row=row_num, column=5, value=total)
+EXPORT_MAX_DIAS = int(os.environ.get('EXPORT_MAX_DIAS', 366))
 
-        if fcell.value and not isinstance(fcell.value, str):
-            fcell.number_format = 'DD-MM-YYYY HH:MM:SS'
-        tcell.number_format = '#,##0'
-        tcell.alignment = Alignment(horizontal='right')
 
-        row_num += 1
+@app.route('/exportaciones', methods=['POST'])
+def crear_exportacion():
+    """Inicia en segundo plano la exportación de ventas de varias cajas en un rango
+    de fechas (una hoja por caja). Responde de inmediato con el id del trabajo."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'not_authenticated'}), 401
 
-    # Ajustar anchos y formato final
-    col_widths = [20, 12, 18, 12, 14]
-    for i, w in enumerate(col_widths, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = w
+    allowed_caja_ids = get_allowed_caja_ids()
+    try:
+        desde = datetime.strptime(request.form.get('desde', ''), '%Y-%m-%d').date()
+        hasta = datetime.strptime(request.form.get('hasta', ''), '%Y-%m-%d').date()
+        caja_ids = [int(c) for c in request.form.getlist('cajas')] or list(allowed_caja_ids)
+    except ValueError:
+        return jsonify({'error': 'invalid_filters'}), 400
+    if hasta < desde or (hasta - desde).days >= EXPORT_MAX_DIAS:
+        return jsonify({'error': 'invalid_range', 'max_dias': EXPORT_MAX_DIAS}), 400
+    if not caja_ids or any(c not in allowed_caja_ids for c in caja_ids):
+        return jsonify({'error': 'forbidden_caja'}), 403
+
+    nombres_cajas = {c.id_caja: c.detalle_caja for c in get_all_cajas()}
+    job_id = iniciar_exportacion(
+        session['user_id'],
+        Venta.iter_for_export(caja_ids, desde, hasta),
+        nombres_cajas,
+        filename=f"ventas_{desde:%Y%m%d}_{hasta:%Y%m%d}.xlsx"
+    )
+    return jsonify({
+        'id': job_id,
+        'estado_url': url_for('estado_exportacion', job_id=job_id),
+        'descargar_url': url_for('descargar_exportacion', job_id=job_id),
+    }), 202
 
-    ws.auto_filter.ref = f"A1:E{row_num-1}"
-    ws.freeze_panes = 'A2'
 
-    import io as _io
-    bio = _io.BytesIO()
-    wb.save(bio)
-    bio.seek(0)
+@app.route('/exportaciones/<job_id>')
+def estado_exportacion(job_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'not_authenticated'}), 401
 
-    filename = f"arqueo_{id_apertura}.xlsx"
-    resp = Response(bio.read(), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    resp.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return resp
\ No newline at end of file
+    job = get_exportacion(job_id, session['user_id'])
+    if not job:
+        return jsonify({'error': 'not_found'}), 404
+    return jsonify({'estado': job['estado'], 'filas': job['filas'], 'error': job['error']})
+
+
+@app.route('/exportaciones/<job_id>/descargar')
+def descargar_exportacion(job_id):
+    if 'user_id' not in session:
+        return redirect('/')
+
+    job = get_exportacion(job_id, session['user_id'])
+    if not job or job['estado'] != 'listo':
+        flash('La exportación no existe o todavía no está lista.', 'warning')
+        return redirect(url_for('listar_aperturas'))
+    return send_file(
+        job['path'],
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=job['filename']
+    )
@@ -1,5 +1,21 @@
-from flask_app.config.conexiones import connectToMySQL
-from datetime import datetime
+import os
+from flask_app.config.conexiones import connectToMySQL, DatabaseError
+from flask_app.config.cache import TTLCache
+from datetime import datetime, timedelta
+
+# KPIs del panel de aperturas por conjunto de cajas. Unos pocos segundos bastan
+# para que recargas y polling de varias pestañas no repitan la consulta.
+_kpi_cache = TTLCache(ttl=float(os.environ.get('APERTURAS_KPI_TTL', 5)), max_size=256)
+
+# Si vta_apertura tiene las columnas de totales acumulados (monto_acumulado,
+# ventas_acumuladas). Sólo se recuerda el resultado positivo: mientras falten se
+# comprueba cada vez, así la migración se detecta de inmediato sin reiniciar.
+_running_totals_cache = TTLCache(ttl=60, max_size=1)
+_RUNNING_TOTALS_COLUMNS_QUERY = (
+    "SELECT COUNT(*) AS cnt FROM information_schema.COLUMNS "
+    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'vta_apertura' "
+    "AND COLUMN_NAME IN ('monto_acumulado', 'ventas_acumuladas');"
+)
 
 class Apertura:
     def __init__(self, data):
@@ -16,6 +32,8 @@ class Apertura:
         self.total_ventas = data.get('total_ventas') if isinstance(data, dict) else None
         self.diferencias = data.get('diferencias') if isinstance(data, dict) else None
         self.observaciones = data.get('observaciones') if isinstance(data, dict) else None
+        self.monto_acumulado = data.get('monto_acumulado') if isinstance(data, dict) else None
+        self.ventas_acumuladas = data.get('ventas_acumuladas') if isinstance(data, dict) else None
 
     @classmethod
     def create(cls, data):
@@ -49,6 +67,7 @@ class Apertura:
         except Exception:
             # columna no existe o error, ignorar
             pass
+        cls.invalidate_kpis()
         return id_ap
 
     @classmethod
@@ -71,6 +90,7 @@ class Apertura:
         # excepciones y devuelve False en caso de error, por lo que comprobamos
         # el resultado en lugar de depender de except.
         res_full = connectToMySQL('sistemas').query_db(query_full, data)
+        cls.invalidate_kpis()
         if res_full is not False:
             return res_full
 
@@ -87,14 +107,168 @@ class Apertura:
             return None
         return cls(res[0])
 
+    @classmethod
+    def has_running_totals(cls):
+        """True si vta_apertura ya tiene las columnas monto_acumulado/ventas_acumuladas."""
+        if _running_totals_cache.get('disponible'):
+            return True
+        try:
+            row = connectToMySQL('sistemas').fetch_one(_RUNNING_TOTALS_COLUMNS_QUERY)
+        except DatabaseError as e:
+            # Error de BD: las lecturas usan la suma de vta_ventas, que siempre es correcta
+            print(f"[APERTURA] No se pudo verificar columnas de totales: {e}")
+            return False
+        disponible = int(row.get('cnt') or 0) == 2
+        if disponible:
+            _running_totals_cache.set('disponible', True)
+        return disponible
+
+    @classmethod
+    def add_to_running_totals(cls, cursor, id_apertura, monto):
+        """Suma una venta a los totales acumulados de la apertura. Se ejecuta con el
+        cursor de la transacción de la venta para que ambos cambios se confirmen juntos.
+
+        Si las columnas aún no existen (migración 0002 pendiente) no hace nada y
+        devuelve False. La verificación usa el mismo cursor: si falla, falla la
+        venta, en vez de confirmarla sin sumar su monto."""
+        if not _running_totals_cache.get('disponible'):
+            cursor.execute(_RUNNING_TOTALS_COLUMNS_QUERY)
+            if int(cursor.fetchone()['cnt'] or 0) != 2:
+                return False
+            _running_totals_cache.set('disponible', True)
+        cursor.execute(
+            "UPDATE vta_apertura SET monto_acumulado = monto_acumulado + %(monto)s, "
+            "ventas_acumuladas = ventas_acumuladas + 1 WHERE id_apertura = %(id_apertura)s;",
+            {'monto': monto, 'id_apertura': id_apertura}
+        )
+        return True
+
     @classmethod
     def get_totals_for_apertura(cls, id_apertura):
-        query = "SELECT IFNULL(SUM(total_ventas),0) AS total FROM vta_ventas WHERE id_apertura = %(id_apertura)s"
+        if cls.has_running_totals():
+            query = "SELECT monto_acumulado AS total FROM vta_apertura WHERE id_apertura = %(id_apertura)s"
+        else:
+            query = "SELECT IFNULL(SUM(total_ventas),0) AS total FROM vta_ventas WHERE id_apertura = %(id_apertura)s"
         res = connectToMySQL('sistemas').query_db(query, {'id_apertura': id_apertura})
         if not res:
             return 0
         return res[0].get('total', 0)
 
+    @classmethod
+    def reconcile_totals(cls, id_apertura=None, fix=False):
+        """
+        Compara los totales acumulados con la suma real de vta_ventas.
+        Devuelve la lista de aperturas con diferencias (dicts con acumulado y real).
+        Con `fix=True` corrige cada diferencia bloqueando la fila de la apertura,
+        de modo que no se pierdan ventas que se registren mientras tanto.
+        """
+        where = "WHERE a.id_apertura = %(id_apertura)s" if id_apertura else ""
+        query = f"""
+            SELECT a.id_apertura, a.monto_acumulado, a.ventas_acumuladas,
+                   IFNULL(SUM(v.total_ventas),0) AS monto_real, COUNT(v.id_ventas) AS ventas_real
+            FROM vta_apertura a LEFT JOIN vta_ventas v ON v.id_apertura = a.id_apertura
+            {where}
+            GROUP BY a.id_apertura, a.monto_acumulado, a.ventas_acumuladas
+            HAVING a.monto_acumulado <> monto_real OR a.ventas_acumuladas <> ventas_real
+            ORDER BY a.id_apertura;
+        """
+        db = connectToMySQL('sistemas')
+        diferencias = db.fetch_all(query, {'id_apertura': id_apertura} if id_apertura else None)
+        if not fix:
+            return diferencias
+
+        for fila in diferencias:
+            # Venta.create actualiza la apertura dentro de su transacción: al tomar el
+            # lock de la fila primero, la suma leída después es consistente con el acumulado
+            with db.transaction() as cursor:
+                cursor.execute("SELECT id_apertura FROM vta_apertura WHERE id_apertura = %(id)s FOR UPDATE;", {'id': fila['id_apertura']})
+                cursor.execute(
+                    "SELECT IFNULL(SUM(total_ventas),0) AS monto, COUNT(id_ventas) AS ventas FROM vta_ventas WHERE id_apertura = %(id)s;",
+                    {'id': fila['id_apertura']}
+                )
+                real = cursor.fetchone()
+                cursor.execute(
+                    "UPDATE vta_apertura SET monto_acumulado = %(monto)s, ventas_acumuladas = %(ventas)s WHERE id_apertura = %(id)s;",
+                    {'monto': real['monto'], 'ventas': real['ventas'], 'id': fila['id_apertura']}
+                )
+        return diferencias
+
+    @classmethod
+    def get_totals_for_aperturas(cls, apertura_ids):
+        """
+        Devuelve {id_apertura: total} para todas las aperturas de `apertura_ids`
+        con una sola consulta agrupada. Las aperturas sin ventas quedan en 0.
+        """
+        if not apertura_ids:
+            return {}
+        ids = list(dict.fromkeys(apertura_ids))
+        totals = {id_ap: 0 for id_ap in ids}
+        placeholders = ','.join(['%s'] * len(ids))
+        if cls.has_running_totals():
+            query = f"SELECT id_apertura, monto_acumulado AS total FROM vta_apertura WHERE id_apertura IN ({placeholders});"
+        else:
+            query = (
+                f"SELECT id_apertura, IFNULL(SUM(total_ventas),0) AS total FROM vta_ventas "
+                f"WHERE id_apertura IN ({placeholders}) GROUP BY id_apertura;"
+            )
+        res = connectToMySQL('sistemas').query_db(query, tuple(ids))
+        for row in res or []:
+            totals[row['id_apertura']] = row.get('total', 0)
+        return totals
+
+    @classmethod
+    def get_kpis_for_cajas(cls, caja_ids):
+        """
+        KPIs del panel de aperturas para `caja_ids` en una sola consulta:
+        ventas y monto de las aperturas iniciadas hoy, aperturas abiertas y
+        fecha del último arqueo. El resultado se cachea unos segundos por conjunto de cajas.
+        """
+        kpis = {'ventas_count': 0, 'ventas_total_hoy': 0, 'arqueos_abiertos_count': 0, 'ultimo_arqueo_creado': None}
+        if not caja_ids:
+            return kpis
+        key = tuple(sorted(set(caja_ids)))
+        cached = _kpi_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+
+        placeholders = ','.join(['%s'] * len(key))
+        # "Hoy" como rango semiabierto sobre fecha_inicio_apertura (DATE(col) impide usar el índice).
+        # Los límites se calculan en MySQL (CURDATE()), no con el reloj del servidor de la app,
+        # para que coincidan con las fechas que guarda la base; siguen siendo constantes de la query.
+        # Las ventas del día se aproximan por la fecha de la apertura asociada, igual que antes.
+        query = f"""
+            SELECT hoy.cnt, hoy.total, abiertas.cnt AS abiertas, ultimo.fecha AS ultimo
+            FROM (
+                SELECT COUNT(v.id_ventas) AS cnt, IFNULL(SUM(v.total_ventas),0) AS total
+                FROM vta_apertura a JOIN vta_ventas v ON v.id_apertura = a.id_apertura
+                WHERE a.id_caja_fk IN ({placeholders}) AND a.fecha_inicio_apertura >= CURDATE() AND a.fecha_inicio_apertura < CURDATE() + INTERVAL 1 DAY
+            ) hoy
+            CROSS JOIN (
+                SELECT COUNT(*) AS cnt FROM vta_apertura WHERE estado_apertura = 1 AND id_caja_fk IN ({placeholders})
+            ) abiertas
+            CROSS JOIN (
+                SELECT MAX(fecha_inicio_apertura) AS fecha FROM vta_apertura WHERE id_caja_fk IN ({placeholders})
+            ) ultimo;
+        """
+        params = key + key + key
+        try:
+            row = connectToMySQL('sistemas').fetch_one(query, params)
+        except DatabaseError as e:
+            # Error de BD: no cachear para reintentar en el próximo request
+            print(f"[APERTURAS KPI] Error calculando KPIs: {e}")
+            return kpis
+        kpis['ventas_count'] = int(row.get('cnt') or 0)
+        kpis['ventas_total_hoy'] = int(row.get('total') or 0)
+        kpis['arqueos_abiertos_count'] = int(row.get('abiertas') or 0)
+        kpis['ultimo_arqueo_creado'] = row.get('ultimo')
+        _kpi_cache.set(key, kpis)
+        return dict(kpis)
+
+    @classmethod
+    def invalidate_kpis(cls):
+        """Descarta los KPIs cacheados (p. ej. al abrir o cerrar una apertura)."""
+        _kpi_cache.invalidate()
+
     @classmethod
     def get_all_by_cajas(cls, caja_ids):
         """
@@ -112,6 +286,68 @@ class Apertura:
             return []
         return [cls(r) for r in res]
 
+    @staticmethod
+    def encode_cursor(apertura):
+        """Cursor de paginación: fecha de inicio e id de la última apertura entregada."""
+        return f"{apertura.fecha_inicio_apertura:%Y-%m-%dT%H:%M:%S}_{apertura.id_apertura}"
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Inverso de encode_cursor. Lanza ValueError si el cursor es inválido."""
+        fecha, _, id_apertura = cursor.rpartition('_')
+        return datetime.strptime(fecha, '%Y-%m-%dT%H:%M:%S'), int(id_apertura)
+
+    @classmethod
+    def get_page_by_cajas(cls, caja_ids, limit=50, cursor=None, desde=None, hasta=None):
+        """
+        Página de aperturas de `caja_ids` ordenadas de la más reciente a la más antigua.
+
+        Paginación por keyset: `cursor` es (fecha_inicio, id_apertura) de la última
+        fila de la página anterior, así el costo no crece con el historial (no hay OFFSET).
+        `desde`/`hasta` (date) filtran por fecha de inicio, ambos inclusive.
+        Devuelve (aperturas, next_cursor); next_cursor es None en la última página.
+        """
+        if not caja_ids:
+            return [], None
+        query, params = cls.page_query(caja_ids, limit, cursor, desde, hasta)
+        res = connectToMySQL('sistemas').query_db(query, params)
+        if not res:
+            return [], None
+        aperturas = [cls(r) for r in res[:limit]]
+        next_cursor = cls.encode_cursor(aperturas[-1]) if len(res) > limit else None
+        return aperturas, next_cursor
+
+    @classmethod
+    def page_query(cls, caja_ids, limit=50, cursor=None, desde=None, hasta=None):
+        """(query, params) de get_page_by_cajas, con una fila extra para detectar la
+        página siguiente. También lo usa la verificación de planes de migraciones."""
+        where = ["id_caja_fk = %s"]
+        filtros = []
+        # Rangos semiabiertos sobre la columna para que MySQL pueda usar el índice
+        if desde:
+            where.append("fecha_inicio_apertura >= %s")
+            filtros.append(desde)
+        if hasta:
+            where.append("fecha_inicio_apertura < %s")
+            filtros.append(hasta + timedelta(days=1))
+        if cursor:
+            fecha_cursor, id_cursor = cursor
+            where.append("(fecha_inicio_apertura < %s OR (fecha_inicio_apertura = %s AND id_apertura < %s))")
+            filtros.extend([fecha_cursor, fecha_cursor, id_cursor])
+        # Se pide una fila extra sólo para saber si existe una página siguiente
+        orden = "ORDER BY fecha_inicio_apertura DESC, id_apertura DESC LIMIT %s"
+        limite = int(limit) + 1
+        # Una subconsulta por caja: cada una recorre idx_vta_apertura_caja_inicio en orden
+        # y se detiene en `limite` filas. Con IN (...) sobre varias cajas MySQL no puede
+        # usar el índice para el ORDER BY y ordena todo el historial antes del LIMIT.
+        sub = f"(SELECT * FROM vta_apertura WHERE {' AND '.join(where)} {orden})"
+        query = " UNION ALL ".join([sub] * len(caja_ids)) + f" {orden};"
+        params = []
+        for id_caja in caja_ids:
+            params += [id_caja] + filtros + [limite]
+        params.append(limite)
+        return query, tuple(params)
+
     @classmethod
     def get_by_id(cls, id_apertura):
         query = "SELECT * FROM vta_apertura WHERE id_apertura = %(id_apertura)s LIMIT 1;"
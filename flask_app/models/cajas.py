@@ -9,13 +9,10 @@ class Caja:
 
     @classmethod
     def get_all(cls):
+        # fetch_all propaga DatabaseError: un error no debe confundirse con "sin cajas"
         query = "SELECT * FROM vta_cajas;"
-        results = connectToMySQL('sistemas').query_db(query)
-        cajas = []
-        if results:
-            for row in results:
-                cajas.append(cls(row))
-        return cajas
+        results = connectToMySQL('sistemas').fetch_all(query)
+        return [cls(row) for row in results]
 
     @classmethod
     def get_by_id(cls, id_caja):
@@ -0,0 +1,111 @@
+from flask_app.config.conexiones import connectToMySQL
+
+class Correo:
+    """Correo saliente en la cola persistente `vta_cola_correos`.
+
+    Estados: 'pendiente' -> 'enviando' (reclamado por un worker) -> 'enviado' | 'error'.
+    """
+
+    # Plazo de un 'enviando': si el proceso que lo reclamó muere, pasado este
+    # tiempo otro worker puede volver a reclamarlo
+    PLAZO_ENVIO_SEGUNDOS = 600
+
+    PENDIENTES_QUERY = """
+        SELECT id_correo FROM vta_cola_correos
+        WHERE estado IN ('pendiente', 'enviando') AND proximo_intento <= NOW()
+        ORDER BY id_correo ASC LIMIT %(limit)s;
+    """
+
+    def __init__(self, data):
+        self.id_correo = data['id_correo']
+        self.id_venta_fk = data.get('id_venta_fk')
+        self.destinatario = data['destinatario']
+        self.asunto = data['asunto']
+        self.cuerpo = data['cuerpo']
+        self.cuerpo_html = data.get('cuerpo_html')
+        self.estado = data['estado']
+        self.intentos = data.get('intentos', 0)
+        self.ultimo_error = data.get('ultimo_error')
+        self.fecha_creacion = data.get('fecha_creacion')
+        self.fecha_envio = data.get('fecha_envio')
+
+    @classmethod
+    def create(cls, data):
+        query = """
+            INSERT INTO vta_cola_correos (id_venta_fk, destinatario, asunto, cuerpo, cuerpo_html)
+            VALUES (%(id_venta_fk)s, %(destinatario)s, %(asunto)s, %(cuerpo)s, %(cuerpo_html)s);
+        """
+        return connectToMySQL('sistemas').query_db(query, data)
+
+    @classmethod
+    def get_by_id(cls, id_correo):
+        query = "SELECT * FROM vta_cola_correos WHERE id_correo = %(id_correo)s LIMIT 1;"
+        res = connectToMySQL('sistemas').query_db(query, {'id_correo': id_correo})
+        if not res:
+            return None
+        return cls(res[0])
+
+    @classmethod
+    def get_ultimo_by_venta(cls, id_venta, caja_ids):
+        """Último correo de la venta, sólo si la venta es de una de `caja_ids`."""
+        if not caja_ids:
+            return None
+        placeholders = ','.join(['%s'] * len(caja_ids))
+        query = (
+            "SELECT c.* FROM vta_cola_correos c "
+            "JOIN vta_ventas v ON v.id_ventas = c.id_venta_fk "
+            "JOIN vta_apertura a ON a.id_apertura = v.id_apertura "
+            f"WHERE c.id_venta_fk = %s AND a.id_caja_fk IN ({placeholders}) "
+            "ORDER BY c.id_correo DESC LIMIT 1;"
+        )
+        res = connectToMySQL('sistemas').query_db(query, (id_venta, *caja_ids))
+        if not res:
+            return None
+        return cls(res[0])
+
+    @classmethod
+    def get_ids_pendientes(cls, limit=100):
+        """IDs de correos pendientes cuyo próximo intento ya venció (incluye los
+        'enviando' cuyo plazo venció: el proceso que los reclamó no terminó)."""
+        res = connectToMySQL('sistemas').query_db(cls.PENDIENTES_QUERY, {'limit': int(limit)})
+        return [r['id_correo'] for r in res or []]
+
+    @classmethod
+    def reclamar(cls, id_correo):
+        """Marca el correo como 'enviando' si nadie más lo tiene. El UPDATE es
+        atómico: entre varios workers o procesos sólo uno obtiene la fila.
+        Devuelve True si este worker debe enviarlo."""
+        query = """
+            UPDATE vta_cola_correos SET estado = 'enviando',
+            proximo_intento = DATE_ADD(NOW(), INTERVAL %(plazo)s SECOND)
+            WHERE id_correo = %(id_correo)s AND estado IN ('pendiente', 'enviando')
+            AND proximo_intento <= NOW();
+        """
+        data = {'id_correo': id_correo, 'plazo': cls.PLAZO_ENVIO_SEGUNDOS}
+        return connectToMySQL('sistemas').execute(query, data) == 1
+
+    @classmethod
+    def marcar_enviado(cls, id_correo):
+        query = """
+            UPDATE vta_cola_correos SET estado = 'enviado', intentos = intentos + 1,
+            ultimo_error = NULL, fecha_envio = NOW()
+            WHERE id_correo = %(id_correo)s;
+        """
+        return connectToMySQL('sistemas').query_db(query, {'id_correo': id_correo})
+
+    @classmethod
+    def marcar_fallido(cls, id_correo, error, reintentar_en=None):
+        """Registra un intento fallido. Si `reintentar_en` (segundos) es None el
+        correo queda en estado 'error' y no se vuelve a intentar."""
+        query = """
+            UPDATE vta_cola_correos SET intentos = intentos + 1, ultimo_error = %(error)s,
+            estado = %(estado)s, proximo_intento = DATE_ADD(NOW(), INTERVAL %(espera)s SECOND)
+            WHERE id_correo = %(id_correo)s;
+        """
+        data = {
+            'id_correo': id_correo,
+            'error': str(error)[:500],
+            'estado': 'pendiente' if reintentar_en is not None else 'error',
+            'espera': int(reintentar_en or 0)
+        }
+        return connectToMySQL('sistemas').query_db(query, data)
@@ -9,11 +9,8 @@ class Permiso:
 
     @classmethod
     def get_by_user_id(cls, user_id):
+        # fetch_all propaga DatabaseError: un error no debe confundirse con "sin permisos"
         query = "SELECT * FROM vta_permiso_usuarios WHERE id_usuario_fk = %(user_id)s;"
         data = {'user_id': user_id}
-        results = connectToMySQL('sistemas').query_db(query, data)
-        permisos = []
-        if results:
-            for row in results:
-                permisos.append(cls(row))
-        return permisos
+        results = connectToMySQL('sistemas').fetch_all(query, data)
+        return [cls(row) for row in results]
@@ -1,4 +1,26 @@
-from flask_app.config.conexiones import connectToMySQL, connectToSQLServer
+import os
+import json
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from flask_app.config.conexiones import connectToMySQL, connectToSQLServer, run_sqlserver_query, DatabaseError
+from flask_app.config.cache import TTLCache
+
+# Catálogo por caja ya combinado (MySQL + Flexline). Los precios de ListaPrecioD
+# cambian rara vez, así que basta refrescar una vez por ventana de TTL.
+_catalog_cache = TTLCache(
+    ttl=float(os.environ.get('CATALOG_CACHE_TTL', 300)),
+    max_size=int(os.environ.get('CATALOG_CACHE_SIZE', 64))
+)
+
+# Último catálogo conocido en disco, para poder atender cajas tras un reinicio
+# aunque el servidor Flexline no esté disponible.
+CATALOG_SNAPSHOT_PATH = Path(os.environ.get(
+    'CATALOG_SNAPSHOT_PATH',
+    Path(__file__).resolve().parent.parent / 'cache' / 'catalogo_snapshot.json'
+))
 
 class Producto:
     def __init__(self, data):
@@ -10,7 +32,104 @@ class Producto:
         self.kitvirtual = data.get('kitvirtual')
 
     @classmethod
-    def get_by_caja(cls, id_caja):
+    def get_by_caja(cls, id_caja, use_cache=True):
+        # La cache guarda dicts y no instancias: las rutas modifican los objetos
+        # (cantidad, precio variable) y no deben contaminar el catálogo compartido.
+        rows = _catalog_cache.get(id_caja) if use_cache else None
+        if rows is None:
+            rows = cls._fetch_catalog(id_caja)
+            if rows is None:
+                # Origen no disponible: servir el último catálogo conocido, aunque esté vencido
+                rows = _catalog_cache.get(id_caja, allow_stale=True)
+                if rows is None:
+                    return []
+            else:
+                _catalog_cache.set(id_caja, rows)
+        return [cls(row) for row in rows]
+
+    @classmethod
+    def refresh_catalog(cls, id_caja):
+        """Recarga el catálogo de una caja desde las bases de datos.
+        Devuelve True si se actualizó la cache."""
+        rows = cls._fetch_catalog(id_caja)
+        if rows is None:
+            return False
+        _catalog_cache.set(id_caja, rows)
+        return True
+
+    @classmethod
+    def invalidate_cache(cls, id_caja=None):
+        """Descarta el catálogo cacheado de una caja (o de todas si id_caja es None)."""
+        _catalog_cache.invalidate(id_caja)
+
+    @classmethod
+    def save_snapshot(cls, path=None):
+        """Guarda en disco el catálogo cacheado de todas las cajas (escritura atómica)."""
+        path = Path(path or CATALOG_SNAPSHOT_PATH)
+        snapshot = {}
+        for id_caja in _catalog_cache.keys():
+            rows = _catalog_cache.get(id_caja, allow_stale=True)
+            if rows is not None:
+                snapshot[str(id_caja)] = rows
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(path.suffix + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'generado': time.time(), 'cajas': snapshot}, f, default=str)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            print(f"[CATALOGO] No se pudo guardar el snapshot en {path}: {e}")
+            return False
+
+    @classmethod
+    def load_snapshot(cls, path=None):
+        """Carga en la cache el catálogo guardado por save_snapshot. Devuelve cuántas cajas cargó."""
+        path = Path(path or CATALOG_SNAPSHOT_PATH)
+        if not path.exists():
+            return 0
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            print(f"[CATALOGO] Snapshot ilegible en {path}: {e}")
+            return 0
+        loaded = 0
+        for id_caja, rows in (snapshot.get('cajas') or {}).items():
+            for row in rows:
+                # JSON no tiene Decimal: el precio se guardó como texto
+                if row.get('precio') is not None:
+                    row['precio'] = Decimal(str(row['precio']))
+            _catalog_cache.set(int(id_caja), rows)
+            loaded += 1
+        return loaded
+
+    @classmethod
+    def warm_up(cls, caja_ids=None):
+        """Precarga el catálogo de las cajas indicadas (por defecto todas).
+        Devuelve la cantidad de cajas refrescadas correctamente."""
+        if caja_ids is None:
+            from flask_app.models.cajas import Caja
+            try:
+                caja_ids = [c.id_caja for c in Caja.get_all()]
+            except DatabaseError as e:
+                print(f"[CATALOGO] No se pudo obtener el listado de cajas: {e}")
+                return 0
+        refreshed = 0
+        for id_caja in caja_ids:
+            try:
+                if cls.refresh_catalog(id_caja):
+                    refreshed += 1
+            except Exception as e:
+                print(f"[CATALOGO] Error precargando caja {id_caja}: {e}")
+        return refreshed
+
+    @classmethod
+    def _fetch_catalog(cls, id_caja):
+        """Consulta el catálogo en MySQL + SQL Server.
+        Devuelve una lista de dicts ([] si la caja no tiene productos, que se
+        cachea como cualquier catálogo), o None si falló MySQL o Flexline y el
+        resultado no debe cachearse."""
         # 1. Obtener IDs de producto desde MySQL
         mysql_query = """
             SELECT p.id_prod, p.descripcion_prod
@@ -19,23 +138,27 @@ class Producto:
             WHERE cat.id_caja = %(id_caja)s;
         """
         data = {'id_caja': id_caja}
-        mysql_results = connectToMySQL('sistemas').query_db(mysql_query, data)
-
-        if not mysql_results:
-            return []
+        try:
+            mysql_results = connectToMySQL('sistemas').fetch_all(mysql_query, data)
+        except DatabaseError as e:
+            # BD caída o query rechazada: no cachear, se sigue sirviendo el último catálogo
+            print(f"[CATALOGO] Error consultando catálogo de caja {id_caja}: {e}")
+            return None
 
         # Extraer los códigos de producto (campo `descripcion_prod`) para la consulta a SQL Server
         # Filtrar/limpiar valores nulos
         product_ids = [row['descripcion_prod'] for row in mysql_results if row.get('descripcion_prod')]
-        
+        if not product_ids:
+            return []
+
         # 2. Obtener detalles de productos desde SQL Server
         # El placeholder "?" es para pyodbc, que es común en conexiones a SQL Server
         placeholders = ','.join(['?'] * len(product_ids))
-        
+
         sql_server_query = f"""
-            SELECT 
-                p.PRODUCTO as id_producto, 
-                p.GLOSA as nombre, 
+            SELECT
+                p.PRODUCTO as id_producto,
+                p.GLOSA as nombre,
                 l.Valor * 1.19 AS precio,
                 p.COMPUESTO as compuesto,
                 p.KitVirtual as kitvirtual
@@ -44,28 +167,61 @@ class Producto:
             WHERE l.IdLisPrecio IN (176, 168) AND p.PRODUCTO IN ({placeholders})
             ORDER BY p.GLOSA;
         """
-        
-        # La función de conexión debería poder manejar los parámetros de forma segura
+
+        # Se usa run_sqlserver_query (que propaga errores) para no cachear un catálogo
+        # vacío cuando Flexline no responde
         try:
-            sql_server_results = connectToSQLServer('BDFlexline').query_db(sql_server_query, tuple(product_ids))
+            sql_server_results = run_sqlserver_query(connectToSQLServer('BDFlexline').pool, sql_server_query, tuple(product_ids))
         except Exception as e:
             print(f"Error connecting to SQL Server: {e}")
-            return [] # Retornar vacío si falla la conexión
+            return None
 
         # 3. Mapear detalles a los productos
         productos_dict = {row['id_producto']: row for row in sql_server_results}
-        
+
         final_products = []
         for row in mysql_results:
             codigo = row.get('descripcion_prod')
             product_detail = productos_dict.get(codigo)
             if product_detail:
                 # Combinar la información
-                full_product_data = {
+                final_products.append({
                     'id_prod': row.get('id_prod'),
                     'id_producto': codigo,
                     **product_detail
-                }
-                final_products.append(cls(full_product_data))
-        
+                })
+
         return final_products
+
+
+_warmer_thread = None
+
+
+def start_catalog_warmer(interval=None):
+    """Inicia (una sola vez) el hilo que precarga y refresca el catálogo de todas
+    las cajas fuera del camino de los requests, guardando un snapshot en disco.
+
+    El intervalo por defecto es menor al TTL de la cache para que las cajas
+    precargadas nunca expiren mientras el hilo funciona.
+    """
+    global _warmer_thread
+    if _warmer_thread is not None:
+        return _warmer_thread
+    if interval is None:
+        interval = float(os.environ.get('CATALOG_REFRESH_INTERVAL', _catalog_cache.ttl * 0.8))
+
+    def _loop():
+        loaded = Producto.load_snapshot()
+        if loaded:
+            print(f"[CATALOGO] Snapshot cargado: {loaded} cajas")
+        while True:
+            started = time.monotonic()
+            refreshed = Producto.warm_up()
+            if refreshed:
+                Producto.save_snapshot()
+            print(f"[CATALOGO] Refresco completo: {refreshed} cajas en {time.monotonic() - started:.1f}s")
+            time.sleep(interval)
+
+    _warmer_thread = threading.Thread(target=_loop, name='catalog-warmer', daemon=True)
+    _warmer_thread.start()
+    return _warmer_thread
@@ -1,4 +1,7 @@
 from flask_app.config.conexiones import connectToMySQL
+from flask_app.config.aviso_sync import avisar_venta
+from flask_app.models.apertura import Apertura
+from datetime import timedelta
 
 class Venta:
     def __init__(self, data):
@@ -10,8 +13,11 @@ class Venta:
         self.id_apertura = data['id_apertura']
 
     @classmethod
-    def create(cls, data_venta, items):
-        # Crear la venta principal
+    def create(cls, data_venta, items, medio_pago=None):
+        """Registra la venta, su detalle y (opcionalmente) el medio de pago en una
+        sola transacción: o se guarda todo o no queda nada (sin filas huérfanas).
+        `medio_pago` es un dict con 'tipo' e 'id_voucher'.
+        Devuelve el id de la venta o None si falló."""
         # Se agregan campos nuevos: id_correlativo_flex (NOT NULL) y envio_boleta
         # Si no vienen en data_venta, se asumen valores por defecto (0)
         if 'id_correlativo_flex' not in data_venta:
@@ -23,24 +29,69 @@ class Venta:
             INSERT INTO vta_ventas (total_ventas, id_apertura, envio_correo, id_cliente_fk, id_correlativo_flex, envio_boleta) 
             VALUES (%(total_ventas)s, %(id_apertura)s, %(envio_correo)s, %(id_cliente_fk)s, %(id_correlativo_flex)s, %(envio_boleta)s);
         """
-        id_venta = connectToMySQL('sistemas').query_db(query_venta, data_venta)
+        query_detalle = """
+            INSERT INTO vta_detalle_ventas (id_venta, id_producto_fk, cantidad, id_listaprecio) 
+            VALUES (%(id_venta)s, %(id_producto_fk)s, %(cantidad)s, %(id_listaprecio)s);
+        """
+        query_medio = """
+            INSERT INTO vta_mediopago (tipo_pago, id_voucher, id_ventas_fk)
+            VALUES (%(tipo)s, %(id_voucher)s, %(id_venta)s);
+        """
 
-        if not id_venta:
-            return None
+        try:
+            with connectToMySQL('sistemas').transaction() as cursor:
+                # Crear la venta principal
+                cursor.execute(query_venta, data_venta)
+                id_venta = cursor.lastrowid
+
+                # Crear los detalles de la venta: executemany los envía como un único INSERT multi-fila
+                detalles = [{
+                    'id_venta': id_venta,
+                    'id_producto_fk': item.get('id_prod'),
+                    'cantidad': item.get('cantidad', 0),
+                    # permitir que el item proporcione id_listaprecio, o usar 176 por defecto
+                    'id_listaprecio': item.get('id_listaprecio', 176)
+                } for item in items]
+                if detalles:
+                    cursor.executemany(query_detalle, detalles)
+
+                if medio_pago and medio_pago.get('tipo'):
+                    cursor.execute(query_medio, {
+                        'tipo': medio_pago['tipo'],
+                        'id_voucher': medio_pago.get('id_voucher', 0),
+                        'id_venta': id_venta
+                    })
 
-        # Crear los detalles de la venta
-        for item in items:
-            query_detalle = """
-                INSERT INTO vta_detalle_ventas (id_venta, id_producto_fk, cantidad, id_listaprecio) 
-                VALUES (%(id_venta)s, %(id_producto_fk)s, %(cantidad)s, %(id_listaprecio)s);
-            """
-            data_detalle = {
-                'id_venta': id_venta,
-                'id_producto_fk': item.get('id_prod'),
-                'cantidad': item.get('cantidad', 0),
-                # permitir que el item proporcione id_listaprecio, o usar 176 por defecto
-                'id_listaprecio': item.get('id_listaprecio', 176)
-            }
-            connectToMySQL('sistemas').query_db(query_detalle, data_detalle)
+                # Al final para mantener lo menos posible el lock sobre la fila de la apertura
+                Apertura.add_to_running_totals(cursor, data_venta['id_apertura'], data_venta['total_ventas'])
+        except Exception as e:
+            print("[Venta.create] Error, venta revertida:", e)
+            return None
 
+        # Ya confirmada: despertar al agente de sincronización si está escuchando
+        avisar_venta(id_venta)
         return id_venta
+
+    @classmethod
+    def iter_for_export(cls, caja_ids, desde, hasta):
+        """Ventas de `caja_ids` con fecha_venta entre `desde` y `hasta` (date, inclusive),
+        con medio de pago, ordenadas por caja y venta. Devuelve un iterador que lee
+        las filas por bloques con un cursor del servidor."""
+        query, params = cls.export_query(caja_ids, desde, hasta)
+        return connectToMySQL('sistemas').iter_query(query, params)
+
+    @classmethod
+    def export_query(cls, caja_ids, desde, hasta):
+        """(query, params) de iter_for_export; también la usa la verificación de planes."""
+        placeholders = ','.join(['%s'] * len(caja_ids))
+        query = (
+            "SELECT a.id_caja_fk, a.fecha_inicio_apertura AS fecha_apertura, v.*, "
+            "mp.tipo_pago AS medio_pago, mp.id_voucher AS voucher "
+            "FROM vta_ventas v "
+            "JOIN vta_apertura a ON a.id_apertura = v.id_apertura "
+            "LEFT JOIN vta_mediopago mp ON mp.id_ventas_fk = v.id_ventas "
+            f"WHERE a.id_caja_fk IN ({placeholders}) AND v.fecha_venta >= %s AND v.fecha_venta < %s "
+            "ORDER BY a.id_caja_fk, v.id_ventas;"
+        )
+        params = tuple(caja_ids) + (desde, hasta + timedelta(days=1))
+        return query, params
@@ -0,0 +1,23 @@
+-- Cola persistente de correos salientes (comprobantes de venta).
+CREATE TABLE IF NOT EXISTS `vta_cola_correos` (
+  `id_correo` INT NOT NULL AUTO_INCREMENT,
+  `id_venta_fk` INT NULL,
+  `destinatario` VARCHAR(255) NOT NULL,
+  `asunto` VARCHAR(255) NOT NULL,
+  `cuerpo` TEXT NOT NULL,
+  `cuerpo_html` MEDIUMTEXT NULL,
+  `estado` VARCHAR(15) NOT NULL DEFAULT 'pendiente',
+  `intentos` INT NOT NULL DEFAULT 0,
+  `ultimo_error` VARCHAR(500) NULL,
+  `fecha_creacion` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `proximo_intento` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `fecha_envio` DATETIME NULL DEFAULT NULL,
+  PRIMARY KEY (`id_correo`),
+  INDEX `idx_vta_cola_correos_estado` (`estado` ASC, `proximo_intento` ASC),
+  INDEX `fk_vta_cola_correos_vta_ventas1_idx` (`id_venta_fk` ASC),
+  CONSTRAINT `fk_vta_cola_correos_vta_ventas1`
+    FOREIGN KEY (`id_venta_fk`)
+    REFERENCES `vta_ventas` (`id_ventas`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB;
@@ -0,0 +1,13 @@
+-- Totales de ventas mantenidos por Venta.create en cada apertura.
+ALTER TABLE `vta_apertura`
+  ADD COLUMN `monto_acumulado` BIGINT NOT NULL DEFAULT 0,
+  ADD COLUMN `ventas_acumuladas` INT NOT NULL DEFAULT 0;
+
+-- Inicializar con la suma real. Si hubo ventas durante la migración,
+-- verificar luego con: flask --app server reconciliar-totales
+UPDATE `vta_apertura` a
+  LEFT JOIN (
+    SELECT id_apertura, SUM(total_ventas) AS monto, COUNT(*) AS ventas
+    FROM `vta_ventas` GROUP BY id_apertura
+  ) s ON s.id_apertura = a.id_apertura
+SET a.monto_acumulado = IFNULL(s.monto, 0), a.ventas_acumuladas = IFNULL(s.ventas, 0);
@@ -0,0 +1,26 @@
+-- Índices compuestos para las consultas frecuentes (ver _consultas_frecuentes()
+-- en flask_app/config/migraciones.py y `flask verificar-indices`).
+
+-- id_fx lo usa flex_sync_agent pero no estaba en el script.sql original: se crea
+-- sólo si falta (MySQL no tiene ADD COLUMN IF NOT EXISTS)
+SET @sql = IF(
+  (SELECT COUNT(*) FROM information_schema.COLUMNS
+   WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'vta_ventas' AND COLUMN_NAME = 'id_fx') = 0,
+  'ALTER TABLE `vta_ventas` ADD COLUMN `id_fx` VARCHAR(64) NULL DEFAULT NULL',
+  'DO 0'
+);
+PREPARE stmt FROM @sql;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- Apertura activa por caja, aperturas abiertas (KPIs)
+CREATE INDEX `idx_vta_apertura_caja_estado` ON `vta_apertura` (`id_caja_fk`, `estado_apertura`);
+
+-- Listado paginado de aperturas por caja (keyset sobre fecha de inicio e id)
+CREATE INDEX `idx_vta_apertura_caja_inicio` ON `vta_apertura` (`id_caja_fk`, `fecha_inicio_apertura` DESC, `id_apertura` DESC);
+
+-- Ventas pendientes del agente de sincronización con Factura X
+CREATE INDEX `idx_vta_ventas_pendientes_fx` ON `vta_ventas` (`envio_flex`, `id_fx`, `id_correlativo_flex`);
+
+-- Exportaciones por rango de fechas
+CREATE INDEX `idx_vta_ventas_fecha` ON `vta_ventas` (`fecha_venta`);
@@ -0,0 +1,14 @@
+-- Paso alcanzado por flex_sync_agent en cada venta, para retomar desde ahí:
+--   NULL       sin emitir
+--   'emitida'  boleta creada en Factura X (id_fx, envio_fx = 1), falta el correo
+--   'completa' correo enviado o no corresponde (envio_correo = 1, envio_boleta = 1)
+--   'correo_fallido' emitida, pero el correo falló intentos_correo veces; se revisa a mano
+ALTER TABLE `vta_ventas`
+  ADD COLUMN `paso_sync` VARCHAR(16) NULL DEFAULT NULL,
+  ADD COLUMN `intentos_correo` TINYINT NOT NULL DEFAULT 0;
+
+-- Boletas emitidas con correo pendiente, recorridas por id (keyset) por el agente
+CREATE INDEX `idx_vta_ventas_paso_sync` ON `vta_ventas` (`paso_sync`, `id_ventas`);
+
+-- Las ventas ya emitidas se dan por completas: no se reenvían correos antiguos.
+UPDATE `vta_ventas` SET `paso_sync` = 'completa' WHERE `id_fx` IS NOT NULL AND `id_fx` <> '';
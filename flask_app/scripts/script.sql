@@ -1,4 +1,9 @@
 -- MySQL Workbench Forward Engineering
+--
+-- Esquema completo para instalaciones nuevas. Incluye todas las migraciones de
+-- flask_app/scripts/migraciones: tras crear la base, registrarlas como aplicadas con
+--   flask --app server migrar --baseline
+-- Las bases existentes se actualizan con: flask --app server migrar
 
 SET @OLD_UNIQUE_CHECKS=@@UNIQUE_CHECKS, UNIQUE_CHECKS=0;
 SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS, FOREIGN_KEY_CHECKS=0;
@@ -60,9 +65,13 @@ CREATE TABLE IF NOT EXISTS `sistemas`.`vta_apertura` (
   `fecha_termino_apertura` DATETIME NULL DEFAULT NULL,
   `id_caja_fk` INT NOT NULL,
   `id_usuario_fk` INT NOT NULL,
+  `monto_acumulado` BIGINT NOT NULL DEFAULT 0, -- SUM(total_ventas) mantenido por Venta.create
+  `ventas_acumuladas` INT NOT NULL DEFAULT 0, -- COUNT de ventas mantenido por Venta.create
   PRIMARY KEY (`id_apertura`),
   INDEX `fk_vta_apertura_vta_cajas1_idx` (`id_caja_fk` ASC),
   INDEX `fk_vta_apertura_adrecrear_usuarios1_idx` (`id_usuario_fk` ASC) ,
+  INDEX `idx_vta_apertura_caja_estado` (`id_caja_fk` ASC, `estado_apertura` ASC),
+  INDEX `idx_vta_apertura_caja_inicio` (`id_caja_fk` ASC, `fecha_inicio_apertura` DESC, `id_apertura` DESC),
   CONSTRAINT `fk_vta_apertura_vta_cajas1`
     FOREIGN KEY (`id_caja_fk`)
     REFERENCES `sistemas`.`vta_cajas` (`id_caja`)
@@ -101,8 +110,14 @@ CREATE TABLE IF NOT EXISTS `sistemas`.`vta_ventas` (
   `id_apertura` INT NOT NULL,
   `id_correlativo_flex` INT NOT NULL,
   `id_cliente_fk` INT NULL, -- NUEVO CAMPO FK
+  `id_fx` VARCHAR(64) NULL DEFAULT NULL, -- ID del documento en Factura X (flex_sync_agent)
+  `paso_sync` VARCHAR(16) NULL DEFAULT NULL, -- Paso alcanzado por flex_sync_agent: NULL, 'emitida', 'completa' o 'correo_fallido'
+  `intentos_correo` TINYINT NOT NULL DEFAULT 0, -- Correos fallidos de una boleta ya emitida
   PRIMARY KEY (`id_ventas`),
   INDEX `fk_vta_ventas_vta_apertura1_idx` (`id_apertura` ASC),
+  INDEX `idx_vta_ventas_fecha` (`fecha_venta` ASC),
+  INDEX `idx_vta_ventas_pendientes_fx` (`envio_flex` ASC, `id_fx` ASC, `id_correlativo_flex` ASC),
+  INDEX `idx_vta_ventas_paso_sync` (`paso_sync` ASC, `id_ventas` ASC),
   INDEX `fk_vta_ventas_vta_clientes1_idx` (`id_cliente_fk` ASC), -- NUEVO INDEX
   CONSTRAINT `fk_vta_ventas_vta_apertura1`
     FOREIGN KEY (`id_apertura`)
@@ -218,6 +233,33 @@ ENGINE = InnoDB
 DEFAULT CHARACTER SET = latin1
 COLLATE = latin1_swedish_ci;
 
+-- -----------------------------------------------------
+-- Table `sistemas`.`vta_cola_correos`
+-- Cola persistente de correos salientes (comprobantes de venta).
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `sistemas`.`vta_cola_correos` (
+  `id_correo` INT NOT NULL AUTO_INCREMENT,
+  `id_venta_fk` INT NULL,
+  `destinatario` VARCHAR(255) NOT NULL,
+  `asunto` VARCHAR(255) NOT NULL,
+  `cuerpo` TEXT NOT NULL,
+  `cuerpo_html` MEDIUMTEXT NULL,
+  `estado` VARCHAR(15) NOT NULL DEFAULT 'pendiente', -- pendiente | enviado | error
+  `intentos` INT NOT NULL DEFAULT 0,
+  `ultimo_error` VARCHAR(500) NULL,
+  `fecha_creacion` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `proximo_intento` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `fecha_envio` DATETIME NULL DEFAULT NULL,
+  PRIMARY KEY (`id_correo`),
+  INDEX `idx_vta_cola_correos_estado` (`estado` ASC, `proximo_intento` ASC),
+  INDEX `fk_vta_cola_correos_vta_ventas1_idx` (`id_venta_fk` ASC),
+  CONSTRAINT `fk_vta_cola_correos_vta_ventas1`
+    FOREIGN KEY (`id_venta_fk`)
+    REFERENCES `sistemas`.`vta_ventas` (`id_ventas`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB;
+
 
 SET SQL_MODE=@OLD_SQL_MODE;
 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;
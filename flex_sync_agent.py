@@ -6,21 +6,38 @@ Uso:
     python flex_sync_agent.py --dry-run                    # Ver ventas pendientes
     python flex_sync_agent.py                               # Procesar todas las ventas
     python flex_sync_agent.py --limit 5 --delay 2          # Procesar 5 ventas con delay
+    python flex_sync_agent.py --workers 4                  # Procesar en paralelo (limitado por la API)
+    python flex_sync_agent.py --daemon                     # Proceso permanente (systemd, supervisor)
 """
 
 import requests
 import time
 import logging
 import argparse
+import signal
+import select
+import socket
 import sys
 import pymysql.cursors
-import pyodbc
 import os
 import smtplib
 import random
+import threading
+import json
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from email.message import EmailMessage
 from datetime import datetime
 
+from comun.conexiones import (
+    get_sqlserver_pool, run_sqlserver_query, statement_kind, translate_mysql_error,
+    DatabaseError, DatabaseUnavailable
+)
+from comun.aviso_sync import parse_direccion
+from comun.cache import TTLCache
+
 # Configurar logging
 logging.basicConfig(
     level=logging.INFO,
@@ -28,6 +45,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Marca "no está en cache" (None es un valor válido: producto inexistente en Flex)
+_SIN_CACHE = object()
+
 
 # ============================================================================
 # CONFIGURACIÓN DE BASE DE DATOS
@@ -37,39 +57,83 @@ class MySQLConnection:
     """Conexión a MySQL para la base de datos de sistemas"""
     
     def __init__(self, db='sistemas'):
+        self._connect_kwargs = dict(
+            host=os.environ.get('DB_HOST', '181.212.204.13'),
+            port=int(os.environ.get('DB_PORT', 3306)),
+            user=os.environ.get('DB_USER', 'sistemasu'),
+            password=os.environ.get('DB_PASSWORD', '5rTF422.3E'),
+            db=db,
+            charset='utf8mb4'
+        )
         try:
-            self.connection = pymysql.connect(
-                host=os.environ.get('DB_HOST', '181.212.204.13'),
-                port=int(os.environ.get('DB_PORT', 3306)),
-                user=os.environ.get('DB_USER', 'sistemasu'),
-                password=os.environ.get('DB_PASSWORD', '5rTF422.3E'),
-                db=db,
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor
-            )
+            self.connection = pymysql.connect(cursorclass=pymysql.cursors.DictCursor, **self._connect_kwargs)
             self.connection.autocommit(True)
+            # pymysql no es thread-safe: en modo concurrente las queries se serializan
+            self._lock = threading.RLock()
             logger.info(f"Conexión a base de datos '{db}' establecida")
         except Exception as e:
             logger.error(f"Error al conectar a la base de datos: {e}")
             raise
 
+    def _run(self, fn):
+        """Ejecutar `fn(cursor)` con la conexión compartida (serializado entre hilos).
+        Los errores se propagan como DatabaseUnavailable / QueryError; si la conexión
+        se cayó se intenta reabrir para que la próxima query funcione."""
+        with self._lock:
+            try:
+                with self.connection.cursor() as cursor:
+                    return fn(cursor)
+            except Exception as e:
+                error = translate_mysql_error(e)
+                if isinstance(error, DatabaseUnavailable):
+                    try:
+                        self.connection.ping(reconnect=True)
+                    except Exception:
+                        pass
+                raise error from e
+    
+    def fetch_all(self, query, data=None):
+        """Filas del SELECT como lista de dicts ([] si no hay filas)"""
+        def _fetch(cursor):
+            cursor.execute(query, data or None)
+            return list(cursor.fetchall())
+        return self._run(_fetch)
+    
+    def fetch_one(self, query, data=None):
+        """Primera fila del SELECT o None"""
+        def _fetch(cursor):
+            cursor.execute(query, data or None)
+            return cursor.fetchone()
+        return self._run(_fetch)
+    
+    def execute(self, query, data=None):
+        """Ejecutar UPDATE/DELETE y devolver las filas afectadas (autocommit)"""
+        return self._run(lambda cursor: cursor.execute(query, data or None))
+    
+    def insert(self, query, data=None):
+        """Ejecutar INSERT y devolver el id generado (autocommit)"""
+        def _insert(cursor):
+            cursor.execute(query, data or None)
+            return cursor.lastrowid
+        return self._run(_insert)
+    
+    def execute_many(self, query, seq_of_data):
+        """Ejecutar la query para cada elemento de `seq_of_data`"""
+        return self._run(lambda cursor: cursor.executemany(query, seq_of_data))
+    
     def query_db(self, query, data=None):
-        """Ejecutar query en la base de datos"""
+        """Interfaz histórica: deduce el tipo de query y devuelve [] / False ante errores"""
+        kind = statement_kind(query)
         try:
-            with self.connection.cursor() as cursor:
-                cursor.execute(query, data) if data else cursor.execute(query)
-                
-                if query.strip().lower().startswith("insert"):
-                    self.connection.commit()
-                    return cursor.lastrowid
-                elif query.strip().lower().startswith("select"):
-                    return cursor.fetchall()
-                else:
-                    self.connection.commit()
-                    return True
-        except Exception as e:
+            if kind == 'select':
+                return self.fetch_all(query, data)
+            if kind == 'insert':
+                return self.insert(query, data)
+            self.execute(query, data)
+            return True
+        except DatabaseError as e:
             logger.error(f"Error en query: {e}")
-            if query.strip().lower().startswith("select"):
+            if kind == 'select':
                 return []
             return False
     
@@ -81,18 +145,19 @@ class MySQLConnection:
 
 
 class SQLServerConnection:
-    """Conexión a SQL Server para la base de datos de Flex"""
+    """Conexión a SQL Server para la base de datos de Flex.
+
+    Usa el pool compartido de comun.conexiones (el mismo que usa la app): cada query pide
+    prestada una conexión viva (validada con ping) y la devuelve al terminar,
+    reconectando automáticamente si el servidor cortó la sesión.
+    """
     
     def __init__(self, db='BDFlexline', user='flexline', password='flexline'):
         try:
-            connection_str = (
-                "DRIVER={ODBC Driver 17 for SQL Server};"
-                "SERVER=192.168.1.150,1433;"
-                f"DATABASE={db};"
-                f"UID={user};"
-                f"PWD={password};"
-            )
-            self.connection = pyodbc.connect(connection_str)
+            self.pool = get_sqlserver_pool(db, user, password)
+            # Abrir (y dejar en el pool) una conexión para fallar temprano si Flex no responde
+            with self.pool.connection():
+                pass
             logger.info(f"Conexión a SQL Server '{db}' establecida")
         except Exception as e:
             logger.error(f"Error al conectar a SQL Server: {e}")
@@ -100,35 +165,264 @@ class SQLServerConnection:
     
     def query_db(self, query, data=None):
         """Ejecutar query en SQL Server"""
-        cursor = self.connection.cursor()
         try:
-            if data:
-                cursor.execute(query, data)
-            else:
-                cursor.execute(query)
-            
-            if query.strip().lower().startswith("select"):
-                columns = [column[0] for column in cursor.description]
-                return [dict(zip(columns, row)) for row in cursor.fetchall()]
-            elif query.strip().lower().startswith("insert"):
-                self.connection.commit()
-                return cursor.lastrowid
-            else:
-                self.connection.commit()
-                return True
+            return run_sqlserver_query(self.pool, query, data)
         except Exception as e:
             logger.error(f"Error en query SQL Server: {e}")
-            if query.strip().lower().startswith("select"):
+            if statement_kind(query) == 'select':
                 return []
             return False
+    
+    def fetch_all(self, query, data=None):
+        """Filas del SELECT ([] si no hay filas); a diferencia de query_db, los errores se propagan"""
+        return run_sqlserver_query(self.pool, query, data)
+    
+    def close(self):
+        """Cerrar conexiones ociosas del pool"""
+        self.pool.close_all()
+        logger.info("Conexión a SQL Server cerrada")
+
+
+class SyncState:
+    """Estado persistente entre ejecuciones del agente (archivo JSON).
+    
+    - `ultimo_id`: id_ventas más alto ya procesado (high-water mark). Las
+      siguientes ejecuciones sólo revisan ventas posteriores, más una ventana
+      hacia atrás para las que se marcan como pendientes con retraso.
+    - `fallidas`: ventas que fallaron y se reintentan explícitamente aunque
+      queden fuera de esa ventana.
+    - `emitidas_sin_guardar`: id_fx de boletas que Factura X aceptó pero cuyo
+      UPDATE en vta_ventas falló. Al reintentar esas ventas sólo se repite la
+      escritura, sin volver a emitir (evita boletas duplicadas).
+    - `ultima_revision_completa`: momento (epoch) de la última revisión completa
+      terminada; el modo cron la repite periódicamente (ver FlexSyncAgent.run).
+    """
+    
+    MAX_FALLIDAS = 1000
+    
+    def __init__(self, path):
+        self.path = path
+        self.ultimo_id = 0
+        self.fallidas = set()
+        self.emitidas_sin_guardar = {}
+        self.ultima_revision_completa = 0.0
+        # Los workers de process_venta anotan emisiones mientras el hilo principal guarda
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.ultimo_id = int(data.get('ultimo_id') or 0)
+            self.fallidas = set(int(i) for i in data.get('fallidas') or [])
+            self.emitidas_sin_guardar = {int(k): v for k, v in (data.get('emitidas_sin_guardar') or {}).items()}
+            self.ultima_revision_completa = float(data.get('ultima_revision_completa') or 0)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Estado de sincronización ilegible en {path}, se parte de cero: {e}")
+    
+    def registrar(self, id_venta, exitosa):
+        self.ultimo_id = max(self.ultimo_id, id_venta)
+        if exitosa:
+            self.fallidas.discard(id_venta)
+        else:
+            self.fallidas.add(id_venta)
+    
+    def emision_sin_guardar(self, id_venta):
+        """id_fx ya emitido para la venta y aún no guardado en la base (o None)"""
+        with self._lock:
+            return self.emitidas_sin_guardar.get(id_venta)
+    
+    def anotar_emision_sin_guardar(self, id_venta, id_fx):
+        """Recordar el id_fx de una emisión cuyo UPDATE falló y guardarlo en disco de inmediato"""
+        with self._lock:
+            self.emitidas_sin_guardar[id_venta] = id_fx
+        self.save()
+    
+    def emision_guardada(self, id_venta):
+        with self._lock:
+            self.emitidas_sin_guardar.pop(id_venta, None)
+    
+    def save(self):
+        """Guardar el estado (escritura atómica)"""
+        with self._lock:
+            # Si se acumulan demasiadas fallidas se conservan las más recientes;
+            # las demás las recupera la próxima revisión completa
+            fallidas = sorted(self.fallidas)
+            if len(fallidas) > self.MAX_FALLIDAS:
+                descartadas = fallidas[:-self.MAX_FALLIDAS]
+                fallidas = fallidas[-self.MAX_FALLIDAS:]
+                self.fallidas = set(fallidas)
+                logger.warning(f"Más de {self.MAX_FALLIDAS} ventas fallidas: se dejan de reintentar {len(descartadas)} "
+                               f"(ids {descartadas[0]}..{descartadas[-1]}) hasta la próxima revisión completa")
+            data = {
+                'ultimo_id': self.ultimo_id,
+                'fallidas': fallidas,
+                'emitidas_sin_guardar': {str(k): v for k, v in self.emitidas_sin_guardar.items()},
+                'ultima_revision_completa': self.ultima_revision_completa,
+            }
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.error(f"No se pudo guardar el estado de sincronización en {self.path}: {e}")
+
+
+class RateLimiter:
+    """Token bucket thread-safe: como máximo `burst` llamadas seguidas y luego
+    una cada `interval` segundos, sin importar cuántos hilos lo compartan."""
+    
+    def __init__(self, interval, burst=1):
+        self.interval = max(0.0, float(interval))
+        self.capacity = max(1, int(burst))
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Bloquear hasta que haya un token disponible"""
+        if self.interval <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) / self.interval)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.interval
+            time.sleep(wait)
+
+
+class SMTPSessionPool:
+    """
+    Sesiones SMTP_SSL autenticadas y de larga duración: una por cuenta,
+    reutilizadas entre mensajes. Cada envío toma la primera cuenta libre
+    (rotando entre ellas), respeta un intervalo mínimo por cuenta y, si el
+    servidor cortó la sesión, reconecta y reintenta una vez.
+    """
+    
+    # Validar con NOOP las sesiones que estuvieron ociosas más de estos segundos
+    NOOP_AFTER = 30
+    
+    def __init__(self, server, port, cuentas, min_interval=0.0, timeout=30):
+        self.server = server
+        self.port = port
+        self.min_interval = max(0.0, float(min_interval))
+        self.timeout = timeout
+        self._cuentas = [
+            {'user': user, 'password': password, 'smtp': None, 'last_used': 0.0, 'lock': threading.Lock()}
+            for user, password in cuentas
+        ]
+        self._next = 0
+        self._next_lock = threading.Lock()
+    
+    def _connect(self, cuenta):
+        # Puerto 465 usa SMTP_SSL, no SMTP con starttls
+        smtp = smtplib.SMTP_SSL(self.server, self.port, timeout=self.timeout)
+        try:
+            smtp.login(cuenta['user'], cuenta['password'])
+        except Exception:
+            smtp.close()
+            raise
+        cuenta['smtp'] = smtp
+        logger.info(f"Sesión SMTP abierta para {cuenta['user']}")
+        return smtp
+    
+    def _disconnect(self, cuenta):
+        smtp, cuenta['smtp'] = cuenta['smtp'], None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                try:
+                    smtp.close()
+                except Exception:
+                    pass
+    
+    def _session(self, cuenta):
+        """Sesión viva de la cuenta (abriendo o reabriendo si hace falta)"""
+        smtp = cuenta['smtp']
+        if smtp is not None and time.monotonic() - cuenta['last_used'] > self.NOOP_AFTER:
+            try:
+                if smtp.noop()[0] != 250:
+                    raise smtplib.SMTPServerDisconnected('NOOP rechazado')
+            except Exception:
+                self._disconnect(cuenta)
+                smtp = None
+        return smtp or self._connect(cuenta)
+    
+    def _acquire_cuenta(self):
+        """Tomar la primera cuenta libre empezando por la siguiente en la rotación"""
+        with self._next_lock:
+            inicio = self._next
+            self._next = (self._next + 1) % len(self._cuentas)
+        orden = self._cuentas[inicio:] + self._cuentas[:inicio]
+        for cuenta in orden:
+            if cuenta['lock'].acquire(blocking=False):
+                return cuenta
+        # Todas ocupadas: esperar a la que correspondía por turno
+        orden[0]['lock'].acquire()
+        return orden[0]
+    
+    def send_message(self, msg):
+        """
+        Enviar un mensaje con alguna de las cuentas (se fija como remitente)
+        
+        Returns:
+            str: Cuenta que envió el mensaje
+        """
+        cuenta = self._acquire_cuenta()
+        try:
+            espera = self.min_interval - (time.monotonic() - cuenta['last_used'])
+            if espera > 0:
+                time.sleep(espera)
+            
+            del msg['From']
+            msg['From'] = cuenta['user']
+            try:
+                self._session(cuenta).send_message(msg)
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+                # Rechazo del mensaje: la sesión sigue sirviendo, no reintentar
+                raise
+            except smtplib.SMTPAuthenticationError:
+                # Credenciales rechazadas: reconectar con las mismas volvería a fallar
+                logger.error(f"Autenticación SMTP rechazada para {cuenta['user']}")
+                raise
+            except OSError as e:
+                # Sesión cortada por el servidor: reconectar una vez y reintentar
+                logger.warning(f"Sesión SMTP de {cuenta['user']} interrumpida ({e}), reconectando...")
+                self._disconnect(cuenta)
+                self._connect(cuenta).send_message(msg)
+            return cuenta['user']
         finally:
-            cursor.close()
+            cuenta['last_used'] = time.monotonic()
+            cuenta['lock'].release()
     
     def close(self):
-        """Cerrar conexión"""
-        if self.connection:
-            self.connection.close()
-            logger.info("Conexión a SQL Server cerrada")
+        """Cerrar todas las sesiones abiertas"""
+        for cuenta in self._cuentas:
+            with cuenta['lock']:
+                self._disconnect(cuenta)
+
+
+def allowed_interval_from_token(token, default=1.0):
+    """
+    Leer el intervalo mínimo entre requests (claim com.axteroid.allowed_interval,
+    en milisegundos) desde el JWT de Factura X
+    
+    Returns:
+        float: Intervalo en segundos (o `default` si el token no lo indica)
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims['com.axteroid.allowed_interval']) / 1000.0
+    except Exception:
+        return default
 
 
 # ============================================================================
@@ -156,6 +450,46 @@ class FlexSyncAgent:
         "L7MVjISZvw1t",
         "3RJC^Of(L_t}"
     ]
+    # Segundos mínimos entre correos de una misma cuenta (límite de envío del hosting)
+    SMTP_MIN_INTERVAL = 1.0
+    
+    # Códigos por consulta IN a Flex (SQL Server admite hasta 2100 parámetros)
+    FLEX_IN_CHUNK = 500
+    # Nombres (GLOSA) de Flex en memoria: acotados y renovados periódicamente,
+    # porque en modo daemon el proceso vive indefinidamente
+    GLOSA_CACHE_TTL = 3600
+    GLOSA_CACHE_MAX = 5000
+    
+    # Ventas cuyo detalle y cliente se cargan con una sola query por tabla
+    BATCH_SIZE = 100
+    
+    # Ventana hacia atrás (en ids) revisada en cada ejecución incremental: cubre
+    # ventas que Flex marca como pendientes (envio_flex, correlativo) después de crearse
+    LOOKBACK_IDS = 5000
+    SYNC_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.flex_sync_state.json')
+    
+    # Modo daemon: segundos entre consultas de ventas pendientes (adaptativo) y
+    # cada cuánto se hace una revisión completa en vez de la incremental
+    DAEMON_MIN_INTERVAL = 2
+    DAEMON_MAX_INTERVAL = 60
+    DAEMON_FULL_SCAN_INTERVAL = 3600
+    # Con avisos de ventas nuevas (SYNC_AGENT_NOTIFY_ADDR) la consulta periódica sólo
+    # es respaldo de avisos perdidos, así que sin actividad puede espaciarse más
+    DAEMON_MAX_INTERVAL_CON_AVISOS = 300
+    # Modo cron: cada cuánto (segundos) una ejecución hace la revisión completa, para
+    # las ventas que pasan a pendientes más de LOOKBACK_IDS ids por detrás
+    CRON_FULL_SCAN_INTERVAL = 86400
+    
+    # Intentos de correo de una boleta ya emitida antes de dejarla en 'correo_fallido'
+    MAX_INTENTOS_CORREO = 5
+    
+    # Reintentos HTTP ante 429/5xx con backoff exponencial + jitter (segundos base)
+    HTTP_RETRIES = 3
+    HTTP_BACKOFF = 0.5
+    HTTP_RETRY_STATUS = (429, 500, 502, 503, 504)
+    # Un POST (emisión de boleta) sólo se reintenta ante respuestas que aseguran que
+    # no se procesó: un 500/502/504 pudo llegar después de emitir el documento
+    HTTP_RETRY_STATUS_POST = (429, 503)
     
     def __init__(self, api_key=None, workspace_id=None, test_mode=False):
         """
@@ -170,9 +504,30 @@ class FlexSyncAgent:
         self.workspace_id = workspace_id or os.environ.get('FACTURA_X_WORKSPACE_ID') or self.WORKSPACE_ID
         self.smtp_server = os.environ.get('SMTP_SERVER') or self.SMTP_SERVER
         self.smtp_port = int(os.environ.get('SMTP_PORT') or self.SMTP_PORT)
+        self.smtp_pool = SMTPSessionPool(
+            self.smtp_server,
+            self.smtp_port,
+            list(zip(self.SMTP_USERS, self.SMTP_PASSWORDS)),
+            min_interval=float(os.environ.get('SMTP_MIN_INTERVAL', self.SMTP_MIN_INTERVAL))
+        )
         self.test_mode = test_mode or os.environ.get('FACTURA_X_TEST_MODE', '').lower() == 'true'
+        # Ritmo máximo de la API: FACTURA_X_ALLOWED_INTERVAL (segundos) o el claim del token
+        api_interval = os.environ.get('FACTURA_X_ALLOWED_INTERVAL')
+        self.api_interval = float(api_interval) if api_interval else allowed_interval_from_token(self.api_key)
+        self.rate_limiter = RateLimiter(self.api_interval)
+        self.http_retries = int(os.environ.get('FACTURA_X_RETRIES', self.HTTP_RETRIES))
+        self.http = self._create_http_session()
+        self.http_metrics = {}
+        self._metrics_lock = threading.Lock()
         self.db = MySQLConnection('sistemas')
         self.db_flex = SQLServerConnection('BDFlexline', 'flexline', 'flexline')
+        # Nombres de productos de Flex (GLOSA) ya resueltos; None = el código no existe en Flex
+        self._glosa_cache = TTLCache(self.GLOSA_CACHE_TTL, self.GLOSA_CACHE_MAX)
+        self.lookback_ids = int(os.environ.get('SYNC_LOOKBACK_IDS', self.LOOKBACK_IDS))
+        self.state = SyncState(os.environ.get('SYNC_STATE_PATH') or self.SYNC_STATE_PATH)
+        self._detener = threading.Event()
+        self._avisos = None
+        self._paso_sync = None
         
         if not self.api_key:
             logger.warning("No se proporcionó API key de Factura X")
@@ -182,48 +537,250 @@ class FlexSyncAgent:
         else:
             logger.info("✓ MODO PRODUCCIÓN - Las boletas serán REALES")
     
-    def get_random_smtp_credentials(self):
+    def _create_http_session(self):
         """
-        Obtener credenciales SMTP aleatorias para balanceo de carga
-        Cada correo usa su contraseña correspondiente según el índice
+        Crear la sesión HTTP compartida con Factura X: conexiones keep-alive
+        reutilizadas entre envíos (un pool por host) y headers de autenticación fijos
         
         Returns:
-            tuple: (smtp_user, smtp_password)
+            requests.Session: Sesión configurada
         """
-        indice = random.randint(0, len(self.SMTP_USERS) - 1)
-        return self.SMTP_USERS[indice], self.SMTP_PASSWORDS[indice]
-        
-    def get_pending_ventas(self):
+        session = requests.Session()
+        # Los reintentos los maneja http_request (con jitter y métricas), no urllib3
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Authorization': f'Bearer {self.api_key}',
+            'x-ax-workspace': self.workspace_id
+        })
+        return session
+    
+    def _record_http_metric(self, metric, elapsed, status=None, retried=False, error=False):
+        """Acumular latencia y resultados por tipo de llamada (thread-safe)"""
+        with self._metrics_lock:
+            m = self.http_metrics.setdefault(metric, {
+                'llamadas': 0, 'errores': 0, 'reintentos': 0, 'total_ms': 0.0, 'max_ms': 0.0
+            })
+            ms = elapsed * 1000
+            m['llamadas'] += 1
+            m['total_ms'] += ms
+            m['max_ms'] = max(m['max_ms'], ms)
+            if retried:
+                m['reintentos'] += 1
+            if error or (status is not None and status >= 400):
+                m['errores'] += 1
+    
+    def http_request(self, method, url, metric='http', rate_limited=False, **kwargs):
         """
-        Obtener ventas pendientes de envío a Factura X (envio_flex = 1)
+        Ejecutar un request con la sesión compartida, reintentando ante 429/5xx
+        con backoff exponencial + jitter (respeta Retry-After si viene)
+        
+        Los POST no son idempotentes: sólo se reintentan si la conexión no llegó
+        a establecerse (el request no se envió) o ante 429/503. Un timeout de
+        lectura, una conexión cortada después de enviar el cuerpo (p. ej. un
+        keep-alive que el servidor cerró) o un 500/502/504 pueden haber emitido
+        el documento, y el reintento lo duplicaría.
         
+        Args:
+            method (str): Método HTTP
+            url (str): URL destino
+            metric (str): Nombre con que se registran las métricas de latencia
+            rate_limited (bool): Pasar por el rate limiter de la API en cada intento
+            
         Returns:
-            list: Lista de ventas pendientes
+            requests.Response: Última respuesta obtenida (la excepción se propaga si no hubo respuesta)
         """
-        query = """
-            SELECT 
-                id_ventas,
-                total_ventas,
-                fecha_venta,
-                id_correlativo_flex,
-                id_apertura,
-                id_cliente_fk,
-                id_fx
-            FROM vta_ventas
-            WHERE envio_flex = 1 
-                AND (id_fx IS NULL OR id_fx = '')
-                AND id_correlativo_flex IS NOT NULL 
-                AND id_correlativo_flex > 0
-            ORDER BY id_ventas ASC
+        idempotente = method.upper() != 'POST'
+        reintentables = self.HTTP_RETRY_STATUS if idempotente else self.HTTP_RETRY_STATUS_POST
+        for attempt in range(self.http_retries + 1):
+            ultimo_intento = attempt == self.http_retries
+            if rate_limited:
+                self.rate_limiter.acquire()
+            
+            started = time.monotonic()
+            try:
+                response = self.http.request(method, url, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                self._record_http_metric(metric, time.monotonic() - started, retried=attempt > 0, error=True)
+                if ultimo_intento or not (idempotente or self._fallo_al_conectar(e)):
+                    raise
+                espera = None
+            else:
+                self._record_http_metric(metric, time.monotonic() - started, status=response.status_code, retried=attempt > 0)
+                if response.status_code not in reintentables or ultimo_intento:
+                    return response
+                espera = response.headers.get('Retry-After')
+            
+            try:
+                espera = float(espera)
+            except (TypeError, ValueError):
+                espera = self.HTTP_BACKOFF * (2 ** attempt) + random.uniform(0, self.HTTP_BACKOFF)
+            logger.warning(f"Reintentando {method} {metric} en {espera:.2f}s (intento {attempt + 2}/{self.http_retries + 1})")
+            time.sleep(espera)
+    
+    @staticmethod
+    def _fallo_al_conectar(error):
+        """True si el error ocurrió al abrir la conexión, antes de enviar el request"""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        # requests envuelve el error de urllib3: ConnectionError(MaxRetryError(reason=NewConnectionError))
+        causa = error.args[0] if error.args else None
+        return isinstance(causa, NewConnectionError) or isinstance(getattr(causa, 'reason', None), NewConnectionError)
+    
+    def log_http_metrics(self):
+        """Mostrar latencias acumuladas de las llamadas HTTP"""
+        for metric, m in sorted(self.http_metrics.items()):
+            promedio = m['total_ms'] / m['llamadas'] if m['llamadas'] else 0
+            logger.info(
+                f"HTTP {metric}: {m['llamadas']} llamadas, {m['reintentos']} reintentos, "
+                f"{m['errores']} errores, promedio {promedio:.0f} ms, máx {m['max_ms']:.0f} ms"
+            )
+    
+    # Condición de venta pendiente de envío a Factura X (usa idx_vta_ventas_pendientes_fx).
+    # Con paso_sync también quedan pendientes las ya emitidas cuyo correo falló; esas
+    # se consultan aparte (EMITIDAS_WHERE, idx_vta_ventas_paso_sync) porque un OR entre
+    # ambas condiciones impide usar los índices y obliga a leer todas las ventas enviadas
+    PENDING_WHERE = """
+        envio_flex = 1 
+        AND (id_fx IS NULL OR id_fx = '')
+        AND id_correlativo_flex IS NOT NULL 
+        AND id_correlativo_flex > 0
+    """
+    PENDING_WHERE_PASOS = """
+        envio_flex = 1 
+        AND (id_fx IS NULL OR id_fx = '' OR paso_sync = 'emitida')
+        AND id_correlativo_flex IS NOT NULL 
+        AND id_correlativo_flex > 0
+    """
+    EMITIDAS_WHERE = "paso_sync = 'emitida'"
+    PENDING_COLUMNS = """
+        id_ventas,
+        total_ventas,
+        fecha_venta,
+        id_correlativo_flex,
+        id_apertura,
+        id_cliente_fk,
+        id_fx
+    """
+    
+    @classmethod
+    def pending_page_query(cls, where, columns=None):
+        """Página keyset de ventas que cumplen `where` (parámetros: id_ventas desde, límite).
+        También la usa la verificación de planes de flask_app.config.migraciones."""
+        return (
+            f"SELECT {columns or cls.PENDING_COLUMNS} FROM vta_ventas "
+            f"WHERE {where} AND id_ventas > %s ORDER BY id_ventas ASC LIMIT %s"
+        )
+    
+    @classmethod
+    def pending_count_query(cls, con_paso_sync=True):
+        """Conteo de ventas pendientes: nuevas + emitidas con correo pendiente (si existe paso_sync)"""
+        query = f"SELECT (SELECT COUNT(*) FROM vta_ventas WHERE {cls.PENDING_WHERE})"
+        if con_paso_sync:
+            # Las emitidas ya tienen id_fx: no se cuentan dos veces
+            query += f" + (SELECT COUNT(*) FROM vta_ventas WHERE {cls.EMITIDAS_WHERE})"
+        return query + " AS total"
+    
+    def _pending_where(self):
+        return self.PENDING_WHERE_PASOS if self.has_paso_sync() else self.PENDING_WHERE
+    
+    def _pending_columns(self):
+        return self.PENDING_COLUMNS + ", intentos_correo" if self.has_paso_sync() else self.PENDING_COLUMNS
+    
+    def count_pending_ventas(self):
+        """Cantidad total de ventas pendientes (sólo para informar), o None si falla"""
+        try:
+            row = self.db.fetch_one(self.pending_count_query(self.has_paso_sync()))
+            return int(row['total'])
+        except DatabaseError as e:
+            logger.error(f"Error al contar ventas pendientes: {e}")
+            return None
+    
+    def iter_pending_ventas(self, limit=None, full_scan=False):
+        """
+        Iterar las ventas pendientes de envío a Factura X (envio_flex = 1)
+        
+        Por defecto es incremental: primero reintenta las ventas que fallaron
+        antes y las ya emitidas con el correo pendiente, y luego recorre, en
+        páginas de BATCH_SIZE ordenadas por id (keyset), sólo las ventas
+        posteriores al último id procesado menos `lookback_ids`. Así el costo
+        depende de las ventas nuevas y no del tamaño de la tabla.
+        
+        Args:
+            limit (int, optional): Número máximo de ventas a entregar
+            full_scan (bool, optional): Recorrer todas las ventas pendientes desde el inicio
+            
+        Yields:
+            dict: Venta pendiente
         """
+        entregadas = set()
         
         try:
-            ventas = self.db.query_db(query)
-            logger.info(f"Se encontraron {len(ventas)} ventas pendientes de envío")
-            return ventas
-        except Exception as e:
+            if not full_scan and self.state.fallidas:
+                fallidas = sorted(self.state.fallidas)
+                for inicio in range(0, len(fallidas), self.BATCH_SIZE):
+                    bloque = fallidas[inicio:inicio + self.BATCH_SIZE]
+                    placeholders = ','.join(['%s'] * len(bloque))
+                    ventas = self.db.fetch_all(
+                        f"SELECT {self._pending_columns()} FROM vta_ventas "
+                        f"WHERE {self._pending_where()} AND id_ventas IN ({placeholders}) ORDER BY id_ventas ASC",
+                        tuple(bloque)
+                    )
+                    # Las que ya no están pendientes (enviadas por otro medio) se olvidan
+                    self.state.fallidas.difference_update(set(bloque) - {v['id_ventas'] for v in ventas})
+                    for venta in ventas:
+                        if limit and len(entregadas) >= limit:
+                            return
+                        entregadas.add(venta['id_ventas'])
+                        yield venta
+            
+            consultas = []
+            if self.has_paso_sync():
+                # Pocas filas (sólo correos por reintentar): se recorren completas en cada ejecución
+                consultas.append((self.EMITIDAS_WHERE, 0))
+            cursor = 0 if full_scan else max(0, self.state.ultimo_id - self.lookback_ids)
+            consultas.append((self.PENDING_WHERE, cursor))
+            
+            for where, cursor in consultas:
+                query = self.pending_page_query(where, self._pending_columns())
+                while True:
+                    ventas = self.db.fetch_all(query, (cursor, self.BATCH_SIZE))
+                    for venta in ventas:
+                        if venta['id_ventas'] in entregadas:
+                            continue
+                        if limit and len(entregadas) >= limit:
+                            return
+                        entregadas.add(venta['id_ventas'])
+                        yield venta
+                    if len(ventas) < self.BATCH_SIZE:
+                        break
+                    cursor = ventas[-1]['id_ventas']
+        except DatabaseError as e:
             logger.error(f"Error al obtener ventas pendientes: {e}")
-            return []
+    
+    def get_pending_ventas(self, limit=None, full_scan=False):
+        """
+        Obtener ventas pendientes de envío a Factura X (envio_flex = 1)
+        
+        Returns:
+            list: Lista de ventas pendientes
+        """
+        ventas = list(self.iter_pending_ventas(limit, full_scan))
+        logger.info(f"Se encontraron {len(ventas)} ventas pendientes de envío")
+        return ventas
+    
+    @staticmethod
+    def _en_lotes(ventas, batch_size):
+        """Agrupar un iterable de ventas en listas de hasta `batch_size`"""
+        lote = []
+        for venta in ventas:
+            lote.append(venta)
+            if len(lote) >= batch_size:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
     
     def get_venta_detalle(self, id_venta):
         """
@@ -249,28 +806,125 @@ class FlexSyncAgent:
         """
         
         try:
-            detalle = self.db.query_db(query, (id_venta,))
-            
-            # Para cada item, buscar el nombre del producto en Flex
-            for item in detalle:
-                codigo_producto = item.get('descripcion_prod')
-                if codigo_producto:
-                    # Buscar en la base de datos de Flex (SQL Server)
-                    query_flex = "SELECT GLOSA FROM flexline.producto WHERE PRODUCTO = ?"
-                    resultado = self.db_flex.query_db(query_flex, (codigo_producto,))
-                    
-                    if resultado and len(resultado) > 0:
-                        item['nombre_producto_flex'] = resultado[0]['GLOSA']
-                    else:
-                        item['nombre_producto_flex'] = codigo_producto
-                else:
-                    item['nombre_producto_flex'] = 'Producto'
+            detalle = self.db.fetch_all(query, (id_venta,))
             
+            # Resolver los nombres de todos los productos de la venta en una sola consulta a Flex
+            self._aplicar_nombres_flex(detalle)
             return detalle
         except Exception as e:
             logger.error(f"Error al obtener detalle de venta {id_venta}: {e}")
             return []
     
+    def get_nombres_productos_flex(self, codigos):
+        """
+        Obtener el nombre (GLOSA) de varios productos de Flex con consultas IN
+        por bloques, reutilizando lo ya resuelto (también los códigos inexistentes)
+        
+        Args:
+            codigos (iterable): Códigos de producto (descripcion_prod)
+            
+        Returns:
+            dict: {codigo: GLOSA} (None si el producto no existe en Flex)
+        """
+        codigos = [c for c in codigos if c]
+        nombres = {}
+        for codigo in set(codigos):
+            nombre = self._glosa_cache.get(codigo, _SIN_CACHE)
+            if nombre is not _SIN_CACHE:
+                nombres[codigo] = nombre
+        faltantes = sorted(set(codigos) - nombres.keys())
+        
+        for i in range(0, len(faltantes), self.FLEX_IN_CHUNK):
+            bloque = faltantes[i:i + self.FLEX_IN_CHUNK]
+            placeholders = ','.join(['?'] * len(bloque))
+            query_flex = f"SELECT PRODUCTO, GLOSA FROM flexline.producto WHERE PRODUCTO IN ({placeholders})"
+            try:
+                resultado = self.db_flex.fetch_all(query_flex, tuple(bloque))
+            except Exception as e:
+                # Error de conexión: no cachear, se reintenta en la próxima venta
+                logger.error(f"Error consultando nombres de productos en Flex: {e}")
+                continue
+            encontrados = {row['PRODUCTO']: row['GLOSA'] for row in resultado}
+            # Los códigos que Flex no conoce también se recuerdan (None) para no volver a consultarlos
+            for codigo in bloque:
+                nombres[codigo] = encontrados.get(codigo)
+                self._glosa_cache.set(codigo, nombres[codigo])
+            logger.debug(f"Nombres de Flex resueltos: {len(encontrados)} de {len(bloque)} códigos")
+        
+        return {c: nombres.get(c) for c in codigos}
+    
+    def _aplicar_nombres_flex(self, detalle):
+        """Completar 'nombre_producto_flex' en cada item usando una sola resolución por lote"""
+        nombres = self.get_nombres_productos_flex([item.get('descripcion_prod') for item in detalle])
+        for item in detalle:
+            codigo_producto = item.get('descripcion_prod')
+            if codigo_producto:
+                item['nombre_producto_flex'] = nombres.get(codigo_producto) or codigo_producto
+            else:
+                item['nombre_producto_flex'] = 'Producto'
+    
+    def load_ventas_batch(self, ventas):
+        """
+        Cargar en bloque el detalle, los nombres de productos y los clientes
+        de un lote de ventas (una query por tabla en vez de una por venta)
+        
+        Args:
+            ventas (list): Ventas del lote
+            
+        Returns:
+            dict: {id_venta: {'detalle': list, 'cliente': dict|None}}
+        """
+        if not ventas:
+            return {}
+        
+        ids_venta = [v['id_ventas'] for v in ventas]
+        placeholders = ','.join(['%s'] * len(ids_venta))
+        query_detalle = f"""
+            SELECT 
+                dv.id_venta,
+                dv.id_detalle_ventas,
+                dv.id_listaprecio,
+                dv.cantidad,
+                dv.id_producto_fk,
+                p.descripcion_prod,
+                CAST(dv.id_listaprecio AS UNSIGNED) as precio_unitario
+            FROM vta_detalle_ventas dv
+            INNER JOIN vta_productos p ON dv.id_producto_fk = p.id_prod
+            WHERE dv.id_venta IN ({placeholders})
+            ORDER BY dv.id_venta, dv.id_detalle_ventas
+        """
+        
+        datos = {id_venta: {'detalle': [], 'cliente': None} for id_venta in ids_venta}
+        
+        try:
+            detalle = self.db.fetch_all(query_detalle, tuple(ids_venta))
+            self._aplicar_nombres_flex(detalle)
+            for item in detalle:
+                datos[item.pop('id_venta')]['detalle'].append(item)
+            
+            ids_cliente = sorted(set(v['id_cliente_fk'] for v in ventas if v.get('id_cliente_fk')))
+            if ids_cliente:
+                placeholders = ','.join(['%s'] * len(ids_cliente))
+                query_clientes = f"""
+                    SELECT 
+                        id_cliente,
+                        nombre_cliente,
+                        apellido_cliente,
+                        email_cliente,
+                        telefono_cliente
+                    FROM vta_clientes
+                    WHERE id_cliente IN ({placeholders})
+                """
+                clientes = {c['id_cliente']: c for c in self.db.fetch_all(query_clientes, tuple(ids_cliente))}
+                for venta in ventas:
+                    datos[venta['id_ventas']]['cliente'] = clientes.get(venta.get('id_cliente_fk'))
+            
+            logger.info(f"Lote de {len(ventas)} ventas cargado: {len(detalle)} items, {len(ids_cliente)} clientes")
+            return datos
+        except Exception as e:
+            logger.error(f"Error al cargar lote de ventas: {e}")
+            return {}
+    
     def get_cliente_info(self, id_cliente):
         """
         Obtener información del cliente
@@ -296,8 +950,7 @@ class FlexSyncAgent:
         """
         
         try:
-            clientes = self.db.query_db(query, (id_cliente,))
-            return clientes[0] if clientes else None
+            return self.db.fetch_one(query, (id_cliente,))
         except Exception as e:
             logger.error(f"Error al obtener información del cliente {id_cliente}: {e}")
             return None
@@ -384,21 +1037,17 @@ class FlexSyncAgent:
                 }
             }
             
-            # Preparar headers
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'x-ax-workspace': self.workspace_id,
-                'Content-Type': 'application/json'
-            }
-            
-            # Enviar request a la API
+            # Enviar request a la API (headers de autenticación ya están en la sesión HTTP)
             logger.info(f"Enviando venta {venta['id_ventas']} con number={venta['id_correlativo_flex']} a Factura X")
             logger.debug(f"Payload: {factura_json}")
             
-            response = requests.post(
+            # El rate limiter respeta el intervalo permitido por la API aunque haya varios hilos enviando
+            response = self.http_request(
+                'POST',
                 self.FACTURA_X_API_URL,
+                metric='api',
+                rate_limited=True,
                 json=factura_json,
-                headers=headers,
                 timeout=15
             )
             
@@ -421,7 +1070,7 @@ class FlexSyncAgent:
                 
                 # Si no hay URL de PDF pero tenemos ID, construir URL
                 if not pdf_url and doc_id:
-                    pdf_url = f"https://services.factura-x.com/documents/{doc_id}?format=pdf"
+                    pdf_url = self.pdf_url_for(doc_id)
                 
                 if doc_id:
                     logger.info(f"✓ Venta {venta['id_ventas']} enviada exitosamente. ID Factura X: {doc_id}")
@@ -452,117 +1101,97 @@ class FlexSyncAgent:
             logger.error(f"✗ Error inesperado al enviar venta {venta['id_ventas']}: {e}")
             return None, None
     
-    def update_id_fx(self, id_venta, id_fx):
-        """
-        Actualizar el campo id_fx en la base de datos
-        
-        Args:
-            id_venta (int): ID de la venta
-            id_fx (str): ID retornado por la API de Factura X
-            
-        Returns:
-            bool: True si se actualizó correctamente
-        """
-        query = """
-            UPDATE vta_ventas
-            SET id_fx = %s
-            WHERE id_ventas = %s
-        """
-        
-        try:
-            result = self.db.query_db(query, (id_fx, id_venta))
-            if result:
-                logger.info(f"✓ ID Factura X '{id_fx}' guardado para venta {id_venta}")
-                return True
-            else:
-                logger.error(f"✗ No se pudo actualizar id_fx para venta {id_venta}")
+    def has_paso_sync(self):
+        """True si vta_ventas ya tiene la columna paso_sync (migración 0004)"""
+        if self._paso_sync is None:
+            try:
+                row = self.db.fetch_one(
+                    "SELECT COUNT(*) AS cnt FROM information_schema.COLUMNS "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'vta_ventas' AND COLUMN_NAME = 'paso_sync'"
+                )
+            except DatabaseError as e:
+                # Error de BD: asumir que no está, sin recordar el resultado
+                logger.error(f"No se pudo verificar la columna paso_sync: {e}")
                 return False
-        except Exception as e:
-            logger.error(f"✗ Error al actualizar id_fx para venta {id_venta}: {e}")
-            return False
+            self._paso_sync = int(row.get('cnt') or 0) > 0
+            if not self._paso_sync:
+                logger.warning("vta_ventas no tiene paso_sync: las ventas con correo fallido no se reintentarán "
+                               "(aplicar migraciones con: flask --app server migrar)")
+        return self._paso_sync
     
-    def update_envio_fx(self, id_venta):
+    def registrar_correo_fallido(self, venta):
         """
-        Actualizar el campo envio_fx a 1 después de enviar a la API
+        Contar un intento fallido de correo de una venta ya emitida
         
-        Args:
-            id_venta (int): ID de la venta
-            
-        Returns:
-            bool: True si se actualizó correctamente
-        """
-        query = """
-            UPDATE vta_ventas
-            SET envio_fx = 1
-            WHERE id_ventas = %s
+        Tras MAX_INTENTOS_CORREO intentos la venta pasa a 'correo_fallido' y deja de
+        reintentarse (p. ej. dirección rechazada por el servidor); queda en el log
+        para revisarla a mano.
         """
+        if not self.has_paso_sync():
+            logger.warning("⊘ Boleta emitida pero el correo falló")
+            return
         
+        intentos = int(venta.get('intentos_correo') or 0) + 1
+        agotado = intentos >= self.MAX_INTENTOS_CORREO
+        paso = 'correo_fallido' if agotado else 'emitida'
         try:
-            result = self.db.query_db(query, (id_venta,))
-            if result:
-                logger.info(f"✓ envio_fx = 1 para venta {id_venta}")
-                return True
-            else:
-                logger.error(f"✗ No se pudo actualizar envio_fx para venta {id_venta}")
-                return False
+            self.db.execute(
+                "UPDATE vta_ventas SET intentos_correo = %s, paso_sync = %s WHERE id_ventas = %s",
+                (intentos, paso, venta['id_ventas'])
+            )
         except Exception as e:
-            logger.error(f"✗ Error al actualizar envio_fx para venta {id_venta}: {e}")
-            return False
-    
-    def update_envio_correo(self, id_venta):
-        """
-        Actualizar el campo envio_correo a 1 después de enviar el correo
+            logger.error(f"✗ Error al registrar el correo fallido de la venta {venta['id_ventas']}: {e}")
+            return
         
-        Args:
-            id_venta (int): ID de la venta
-            
-        Returns:
-            bool: True si se actualizó correctamente
-        """
-        query = """
-            UPDATE vta_ventas
-            SET envio_correo = 1
-            WHERE id_ventas = %s
-        """
-        
-        try:
-            result = self.db.query_db(query, (id_venta,))
-            if result:
-                logger.info(f"✓ envio_correo = 1 para venta {id_venta}")
-                return True
-            else:
-                logger.error(f"✗ No se pudo actualizar envio_correo para venta {id_venta}")
-                return False
-        except Exception as e:
-            logger.error(f"✗ Error al actualizar envio_correo para venta {id_venta}: {e}")
-            return False
+        if agotado:
+            logger.error(f"✗ Venta {venta['id_ventas']} (id_fx={venta.get('id_fx')}): el correo falló {intentos} veces, "
+                         f"no se reintentará. Revisar a mano y enviar la boleta al cliente")
+        else:
+            logger.warning(f"⊘ Boleta emitida pero el correo falló (intento {intentos} de {self.MAX_INTENTOS_CORREO}): "
+                           f"se reintentará desde el envío de correo")
+    
+    @staticmethod
+    def pdf_url_for(doc_id):
+        """URL del PDF de un documento de Factura X"""
+        return f"https://services.factura-x.com/documents/{doc_id}?format=pdf"
     
-    def update_envio_boleta(self, id_venta):
+    def update_paso_sync(self, id_venta, paso, id_fx=None):
         """
-        Actualizar el campo envio_boleta a 1 después de enviar el correo
+        Registrar en una sola escritura el paso alcanzado por una venta
+        
+        - 'emitida': boleta creada en Factura X (id_fx, envio_fx = 1); falta el correo
+        - 'completa': envio_correo = 1 y envio_boleta = 1 (junto con id_fx si se
+          entrega, cuando no hay correo que enviar)
         
         Args:
             id_venta (int): ID de la venta
+            paso (str): 'emitida' o 'completa'
+            id_fx (str, optional): ID retornado por la API de Factura X
             
         Returns:
             bool: True si se actualizó correctamente
         """
-        query = """
-            UPDATE vta_ventas
-            SET envio_boleta = 1
-            WHERE id_ventas = %s
-        """
+        campos = []
+        params = []
+        if id_fx:
+            campos += ['id_fx = %s', 'envio_fx = 1']
+            params.append(id_fx)
+        if paso == 'completa':
+            campos += ['envio_correo = 1', 'envio_boleta = 1']
+        if self.has_paso_sync():
+            campos.append('paso_sync = %s')
+            params.append(paso)
+        params.append(id_venta)
+        
+        query = f"UPDATE vta_ventas SET {', '.join(campos)} WHERE id_ventas = %s"
         
         try:
-            result = self.db.query_db(query, (id_venta,))
-            if result:
-                logger.info(f"✓ envio_boleta = 1 para venta {id_venta}")
-                return True
-            else:
-                logger.error(f"✗ No se pudo actualizar envio_boleta para venta {id_venta}")
-                return False
+            # Sin excepción la escritura quedó hecha (filas afectadas = 0 si ya tenía esos valores)
+            self.db.execute(query, tuple(params))
+            logger.info(f"✓ Venta {id_venta}: paso '{paso}' guardado" + (f" (id_fx '{id_fx}')" if id_fx else ""))
+            return True
         except Exception as e:
-            logger.error(f"✗ Error al actualizar envio_boleta para venta {id_venta}: {e}")
+            logger.error(f"✗ Error al guardar paso '{paso}' para venta {id_venta}: {e}")
             return False
     
     def download_pdf(self, pdf_url):
@@ -576,12 +1205,7 @@ class FlexSyncAgent:
             bytes|None: Contenido del PDF o None si falla
         """
         try:
-            headers = {
-                'Authorization': f'Bearer {self.api_key}',
-                'x-ax-workspace': self.workspace_id
-            }
-            
-            response = requests.get(pdf_url, headers=headers, timeout=30)
+            response = self.http_request('GET', pdf_url, metric='pdf', timeout=30)
             
             if response.status_code == 200:
                 logger.info(f"✓ PDF descargado exitosamente ({len(response.content)} bytes)")
@@ -633,13 +1257,9 @@ class FlexSyncAgent:
                 f"Club Recrear"
             )
             
-            # Obtener credenciales SMTP aleatorias (correo y su contraseña correspondiente)
-            smtp_user, smtp_password = self.get_random_smtp_credentials()
-            
-            # Crear mensaje
+            # Crear mensaje (el remitente lo asigna el pool según la cuenta que envía)
             msg = EmailMessage()
             msg['Subject'] = subject
-            msg['From'] = smtp_user
             msg['To'] = correo
             msg.set_content(body)
             
@@ -652,13 +1272,9 @@ class FlexSyncAgent:
                     filename=f'boleta_{rut_final}.pdf'
                 )
             
-            # Enviar correo
-            logger.info(f"Enviando correo a {correo} desde {smtp_user}...")
-            
-            # Puerto 465 usa SMTP_SSL, no SMTP con starttls
-            with smtplib.SMTP_SSL(self.smtp_server, self.smtp_port) as smtp:
-                smtp.login(smtp_user, smtp_password)
-                smtp.send_message(msg)
+            # Enviar correo reutilizando una sesión SMTP ya autenticada
+            logger.info(f"Enviando correo a {correo}...")
+            smtp_user = self.smtp_pool.send_message(msg)
             
             logger.info(f"✓ Correo enviado exitosamente a {correo} desde {smtp_user}")
             return True
@@ -710,12 +1326,14 @@ class FlexSyncAgent:
             logger.error(f"✗ Error en validate_and_send_email: {e}")
             return False
     
-    def process_venta(self, venta):
+    def process_venta(self, venta, datos=None):
         """
         Procesar una venta individual
         
         Args:
             venta (dict): Datos de la venta
+            datos (dict, optional): Detalle y cliente precargados por load_ventas_batch;
+                si no se entregan se consultan para esta venta
             
         Returns:
             bool: True si se procesó correctamente
@@ -725,83 +1343,184 @@ class FlexSyncAgent:
             logger.info(f"Procesando venta {venta['id_ventas']}")
             logger.info(f"{'='*60}")
             
-            # Obtener detalle
-            detalle = self.get_venta_detalle(venta['id_ventas'])
-            
-            if not detalle:
-                logger.warning(f"✗ Venta {venta['id_ventas']} no tiene detalles")
-                return False
-            
-            logger.info(f"Detalle: {len(detalle)} items")
-            
             # Obtener información del cliente si existe
             cliente = None
             rut_final = "66666666-6"
             
             if venta.get('id_cliente_fk'):
-                cliente = self.get_cliente_info(venta['id_cliente_fk'])
+                if datos is not None:
+                    cliente = datos.get('cliente')
+                else:
+                    cliente = self.get_cliente_info(venta['id_cliente_fk'])
                 if cliente:
                     logger.info(f"Cliente: {cliente.get('nombre_cliente')} {cliente.get('apellido_cliente', '')}")
                     logger.info(f"Email: {cliente.get('email_cliente', 'Sin correo')}")
             
-            # Enviar a API de Factura X
-            logger.info("Paso 1: Enviando a API de Factura X...")
-            id_fx, pdf_url = self.send_to_facturax_api(venta, detalle, cliente)
-            
-            if not id_fx:
-                logger.error("✗ Falló el envío a la API")
-                return False
-            
-            # Guardar ID en base de datos
-            logger.info("Paso 2: Guardando id_fx en base de datos...")
-            if not self.update_id_fx(venta['id_ventas'], id_fx):
-                logger.error("✗ Falló guardar id_fx")
-                return False
+            con_correo = bool(cliente and cliente.get('email_cliente'))
             
-            # Marcar envio_fx = 1 porque se subió exitosamente a la API
-            logger.info("Paso 3: Marcando envio_fx = 1...")
-            self.update_envio_fx(venta['id_ventas'])
+            if venta.get('id_fx'):
+                # Paso 'emitida' de un intento anterior: no se vuelve a emitir la boleta
+                id_fx = venta['id_fx']
+                pdf_url = self.pdf_url_for(id_fx)
+                logger.info(f"Venta ya emitida en Factura X (id_fx={id_fx}), se retoma en el envío de correo")
+            else:
+                id_fx = self.state.emision_sin_guardar(venta['id_ventas'])
+                if id_fx:
+                    # Factura X ya la aceptó en un intento anterior: sólo falta guardar el id_fx
+                    pdf_url = self.pdf_url_for(id_fx)
+                    logger.info(f"Venta ya emitida en Factura X (id_fx={id_fx}) sin guardar en la base, se reintenta sólo el guardado")
+                else:
+                    # Obtener detalle
+                    if datos is not None:
+                        detalle = datos.get('detalle')
+                    else:
+                        detalle = self.get_venta_detalle(venta['id_ventas'])
+                    
+                    if not detalle:
+                        logger.warning(f"✗ Venta {venta['id_ventas']} no tiene detalles")
+                        return False
+                    
+                    logger.info(f"Detalle: {len(detalle)} items")
+                    
+                    # Enviar a API de Factura X
+                    logger.info("Paso 1: Enviando a API de Factura X...")
+                    id_fx, pdf_url = self.send_to_facturax_api(venta, detalle, cliente)
+                    
+                    if not id_fx:
+                        logger.error("✗ Falló el envío a la API")
+                        return False
+                
+                # Guardar id_fx y envio_fx = 1 en una sola escritura; sin correo que
+                # enviar, la venta queda completa en esa misma escritura
+                logger.info("Paso 2: Guardando id_fx en base de datos...")
+                if not self.update_paso_sync(venta['id_ventas'], 'emitida' if con_correo else 'completa', id_fx=id_fx):
+                    logger.error("✗ Falló guardar id_fx")
+                    self.state.anotar_emision_sin_guardar(venta['id_ventas'], id_fx)
+                    return False
+                self.state.emision_guardada(venta['id_ventas'])
+                
+                if not con_correo:
+                    logger.info("⊘ No se envió correo (sin email del cliente), venta marcada como completa")
+                    logger.info("✓ Proceso exitoso (API completado)")
+                    return True
             
             # Actualizar venta con el id_fx para la validación
             venta['id_fx'] = id_fx
             venta['envio_fx'] = 1
             
-            # Validar y enviar correo si corresponde
-            logger.info("Paso 4: Validando y enviando correo...")
-            if pdf_url and cliente and cliente.get('email_cliente'):
-                email_sent = self.validate_and_send_email(venta, cliente, pdf_url, rut_final)
-                
-                if email_sent:
-                    logger.info("Paso 5: Actualizando envio_correo = 1 y envio_boleta = 1...")
-                    self.update_envio_correo(venta['id_ventas'])
-                    self.update_envio_boleta(venta['id_ventas'])
-                    logger.info("✓ Proceso completo exitoso (API + Email + Boleta)")
-                else:
-                    logger.warning("⊘ Proceso parcial exitoso (API OK, Email falló)")
-            else:
-                if not cliente or not cliente.get('email_cliente'):
-                    logger.info("⊘ No se envió correo (sin email del cliente)")
-                    # Marcar envio_correo = 1 y envio_boleta = 1 aunque no tenga correo
-                    logger.info("Marcando envio_correo = 1 y envio_boleta = 1 (sin correo)")
-                    self.update_envio_correo(venta['id_ventas'])
-                    self.update_envio_boleta(venta['id_ventas'])
-                else:
-                    logger.warning("⊘ No se envió correo (sin PDF URL)")
-                logger.info("✓ Proceso exitoso (API completado)")
+            if not con_correo:
+                # Venta retomada cuyo cliente ya no tiene correo
+                return self.update_paso_sync(venta['id_ventas'], 'completa')
+            
+            # Validar y enviar correo
+            logger.info("Paso 3: Validando y enviando correo...")
+            if not self.validate_and_send_email(venta, cliente, pdf_url, rut_final):
+                self.registrar_correo_fallido(venta)
+                return False
             
+            logger.info("Paso 4: Actualizando envio_correo = 1 y envio_boleta = 1...")
+            if not self.update_paso_sync(venta['id_ventas'], 'completa'):
+                return False
+            logger.info("✓ Proceso completo exitoso (API + Email + Boleta)")
             return True
             
         except Exception as e:
             logger.error(f"✗ Error al procesar venta {venta['id_ventas']}: {e}")
             return False
     
-    def run(self, limit=None, delay=0):
+    def procesar_pendientes(self, limit=None, delay=0, batch_size=None, workers=1, full_scan=False):
+        """
+        Procesar las ventas pendientes por lotes y guardar el avance
+        
+        Si se pidió detener el agente (request_stop) no se comienzan ventas
+        nuevas, pero las que están en curso terminan y quedan registradas.
+        
+        Returns:
+            dict: Estadísticas de procesamiento (total, exitosos, fallidos)
+        """
+        procesadas = 0
+        exitosos = 0
+        fallidos = 0
+        
+        batch_size = batch_size or self.BATCH_SIZE
+        workers = max(1, int(workers or 1))
+        lotes = self._en_lotes(self.iter_pending_ventas(limit, full_scan), batch_size)
+        
+        if workers > 1:
+            logger.info(f"Modo concurrente: {workers} workers, 1 envío cada {self.api_interval:.2f}s como máximo")
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='facturax') as executor:
+                for lote in lotes:
+                    if self._detener.is_set():
+                        break
+                    datos_lote = self.load_ventas_batch(lote)
+                    
+                    def procesar(venta, datos_lote=datos_lote):
+                        # Todo el lote se encola de una vez: al detener, las ventas que aún
+                        # no comenzaron se omiten (None) y quedan pendientes
+                        if self._detener.is_set():
+                            return None
+                        return self.process_venta(venta, datos_lote.get(venta['id_ventas']))
+                    
+                    for venta, success in zip(lote, executor.map(procesar, lote)):
+                        if success is None:
+                            continue
+                        procesadas += 1
+                        self.state.registrar(venta['id_ventas'], success)
+                        if success:
+                            exitosos += 1
+                        else:
+                            fallidos += 1
+                    self.state.save()
+                    logger.info(f"Progreso: {procesadas} ventas procesadas")
+        else:
+            for lote in lotes:
+                # Al comenzar cada lote, cargar detalle y clientes de todas sus ventas
+                datos_lote = self.load_ventas_batch(lote)
+                
+                for venta in lote:
+                    # Esperar entre requests si se especifica (la espera se corta al detener)
+                    if delay > 0 and procesadas > 0:
+                        logger.info(f"Esperando {delay} segundos...")
+                        self._detener.wait(delay)
+                    if self._detener.is_set():
+                        break
+                    
+                    procesadas += 1
+                    logger.info(f"[{procesadas}] Venta ID: {venta['id_ventas']} | Correlativo: {venta['id_correlativo_flex']} | Total: ${venta['total_ventas']}")
+                    
+                    # Si la carga del lote falló, process_venta consulta la venta por separado
+                    success = self.process_venta(venta, datos_lote.get(venta['id_ventas']))
+                    self.state.registrar(venta['id_ventas'], success)
+                    
+                    if success:
+                        exitosos += 1
+                    else:
+                        fallidos += 1
+                
+                # El avance se guarda por lote: si el proceso se corta, la próxima ejecución sigue desde aquí
+                self.state.save()
+                if self._detener.is_set():
+                    break
+        
+        return {
+            'total': procesadas,
+            'exitosos': exitosos,
+            'fallidos': fallidos
+        }
+    
+    def run(self, limit=None, delay=0, batch_size=None, workers=1, full_scan=False):
         """
         Ejecutar el agente para procesar ventas pendientes
         
         Args:
             limit (int, optional): Número máximo de ventas a procesar
-            delay (int, optional): Segundos de espera entre cada venta
+            delay (int, optional): Segundos de espera entre cada venta (sólo modo secuencial)
+            batch_size (int, optional): Ventas cuyo detalle y cliente se cargan juntos
+                (default: BATCH_SIZE)
+            workers (int, optional): Ventas procesadas en paralelo. Con más de 1 el ritmo
+                lo fija el rate limiter de la API en lugar de `delay`
+            full_scan (bool, optional): Ignorar el último id procesado y revisar todas
+                las ventas pendientes
             
         Returns:
             dict: Estadísticas de procesamiento
@@ -810,49 +1529,38 @@ class FlexSyncAgent:
         logger.info("AGENTE DE SINCRONIZACIÓN CON FACTURA X")
         logger.info("="*80 + "\n")
         
-        # Obtener ventas pendientes
-        ventas = self.get_pending_ventas()
+        full_scan_interval = float(os.environ.get('SYNC_CRON_FULL_SCAN_INTERVAL', self.CRON_FULL_SCAN_INTERVAL))
+        revision_programada = (not full_scan and not limit and
+                               time.time() - self.state.ultima_revision_completa >= full_scan_interval)
+        if revision_programada:
+            logger.info(f"Última revisión completa hace más de {full_scan_interval:g}s: se hace una ahora")
+            full_scan = True
         
-        if not ventas:
-            logger.info("✓ No hay ventas pendientes de procesar")
-            return {
-                'total': 0,
-                'exitosos': 0,
-                'fallidos': 0
-            }
+        pendientes = self.count_pending_ventas()
+        if pendientes is not None:
+            logger.info(f"Ventas pendientes en total: {pendientes}")
+        if full_scan:
+            logger.info("Revisión completa: se ignora el último id procesado")
+        else:
+            logger.info(f"Revisión incremental desde el id {max(0, self.state.ultimo_id - self.lookback_ids)} "
+                        f"(+{len(self.state.fallidas)} fallidas a reintentar)")
         
-        # Aplicar límite si se especifica
+        # Las ventas pendientes se leen por páginas: sólo hay un lote en memoria a la vez
         if limit:
-            ventas = ventas[:limit]
-            logger.info(f"Procesando un máximo de {limit} ventas de {len(self.get_pending_ventas())} pendientes\n")
+            logger.info(f"Procesando un máximo de {limit} ventas pendientes\n")
         else:
-            logger.info(f"Procesando todas las ventas pendientes ({len(ventas)})\n")
+            logger.info("Procesando todas las ventas pendientes\n")
         
-        # Procesar ventas
-        exitosos = 0
-        fallidos = 0
+        stats = self.procesar_pendientes(limit, delay, batch_size, workers, full_scan)
         
-        for i, venta in enumerate(ventas, 1):
-            logger.info(f"[{i}/{len(ventas)}] Venta ID: {venta['id_ventas']} | Correlativo: {venta['id_correlativo_flex']} | Total: ${venta['total_ventas']}")
-            
-            success = self.process_venta(venta)
-            
-            if success:
-                exitosos += 1
-            else:
-                fallidos += 1
-            
-            # Esperar entre requests si se especifica
-            if delay > 0 and i < len(ventas):
-                logger.info(f"Esperando {delay} segundos...")
-                time.sleep(delay)
-        
-        # Estadísticas finales
-        stats = {
-            'total': len(ventas),
-            'exitosos': exitosos,
-            'fallidos': fallidos
-        }
+        # Sólo cuenta como revisión completa si recorrió todo (sin límite ni detención)
+        if full_scan and not limit and not self._detener.is_set():
+            self.state.ultima_revision_completa = time.time()
+            self.state.save()
+        
+        if stats['total'] == 0:
+            logger.info("✓ No hay ventas pendientes de procesar")
+            return stats
         
         logger.info("\n" + "="*80)
         logger.info("RESUMEN DE SINCRONIZACIÓN")
@@ -865,36 +1573,163 @@ class FlexSyncAgent:
             tasa = (stats['exitosos'] / stats['total']) * 100
             logger.info(f"Tasa de éxito:     {tasa:.1f}%")
         
+        self.log_http_metrics()
         logger.info("="*80 + "\n")
         
         return stats
     
+    def request_stop(self):
+        """Pedir que el agente se detenga después de las ventas en curso (p. ej. ante SIGTERM)"""
+        if not self._detener.is_set():
+            logger.info("Deteniendo el agente: se terminan las ventas en curso...")
+        self._detener.set()
+        if self._avisos:
+            # Despertar el select() del daemon para que no espere el intervalo completo
+            try:
+                self._avisos.sendto(b'', self._avisos.getsockname())
+            except OSError:
+                pass
+    
+    def _abrir_socket_avisos(self):
+        """Escuchar los avisos de ventas nuevas de la app (UDP local); None si no está configurado"""
+        direccion = parse_direccion(os.environ.get('SYNC_AGENT_NOTIFY_ADDR'))
+        if not direccion:
+            return None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(direccion)
+        except OSError as e:
+            sock.close()
+            logger.warning(f"No se pudo escuchar avisos en {direccion[0]}:{direccion[1]}, "
+                           f"sólo se consultará periódicamente: {e}")
+            return None
+        sock.setblocking(False)
+        logger.info(f"Escuchando avisos de ventas nuevas en {direccion[0]}:{direccion[1]}")
+        return sock
+    
+    def _esperar_siguiente_ciclo(self, segundos):
+        """
+        Esperar hasta el siguiente ciclo del daemon, o menos si llega un aviso de venta nueva
+        
+        Returns:
+            int: Avisos recibidos durante la espera
+        """
+        if not self._avisos:
+            self._detener.wait(segundos)
+            return 0
+        
+        listos, _, _ = select.select([self._avisos], [], [], segundos)
+        avisos = 0
+        # Varios avisos juntos (p. ej. ventas seguidas) se atienden en un único ciclo
+        while listos:
+            try:
+                payload = self._avisos.recv(64)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                logger.debug(f"Error al leer aviso: {e}")
+                break
+            if payload:
+                avisos += 1
+                logger.debug(f"Aviso de venta nueva: {payload.decode('ascii', 'replace')}")
+        return avisos
+    
+    def run_daemon(self, batch_size=None, workers=1, min_interval=None, max_interval=None,
+                   full_scan_interval=None):
+        """
+        Ejecutar el agente como proceso permanente
+        
+        Reutiliza las conexiones (MySQL, pool de SQL Server, sesiones HTTP y SMTP)
+        entre ciclos y consulta las ventas pendientes con un intervalo adaptativo:
+        `min_interval` mientras se estén enviando ventas, y duplicándose hasta
+        `max_interval` mientras no lleguen ventas nuevas. Cada `full_scan_interval`
+        segundos se hace una revisión completa en lugar de la incremental.
+        
+        Si SYNC_AGENT_NOTIFY_ADDR está definida, además escucha en esa dirección
+        los avisos que envía Venta.create y comienza un ciclo apenas llega uno.
+        
+        Returns:
+            dict: Estadísticas acumuladas desde el inicio del daemon
+        """
+        self._avisos = self._abrir_socket_avisos()
+        default_max = self.DAEMON_MAX_INTERVAL_CON_AVISOS if self._avisos else self.DAEMON_MAX_INTERVAL
+        min_interval = float(min_interval or os.environ.get('SYNC_MIN_INTERVAL', self.DAEMON_MIN_INTERVAL))
+        max_interval = max(min_interval, float(max_interval or os.environ.get('SYNC_MAX_INTERVAL', default_max)))
+        full_scan_interval = float(full_scan_interval or os.environ.get('SYNC_FULL_SCAN_INTERVAL', self.DAEMON_FULL_SCAN_INTERVAL))
+        
+        logger.info(f"Modo daemon: intervalo {min_interval:g}-{max_interval:g}s, "
+                    f"revisión completa cada {full_scan_interval:g}s")
+        
+        totales = {'total': 0, 'exitosos': 0, 'fallidos': 0}
+        intervalo = min_interval
+        # La primera vuelta es completa: recupera lo que quedó pendiente mientras el agente no corría
+        ultima_revision_completa = None
+        
+        while not self._detener.is_set():
+            full_scan = (ultima_revision_completa is None or
+                         time.monotonic() - ultima_revision_completa >= full_scan_interval)
+            try:
+                stats = self.procesar_pendientes(batch_size=batch_size, workers=workers, full_scan=full_scan)
+            except Exception as e:
+                # Un error de base de datos o de red no debe terminar el daemon
+                logger.error(f"Error en el ciclo de sincronización: {e}")
+                intervalo = max_interval
+            else:
+                if full_scan:
+                    ultima_revision_completa = time.monotonic()
+                for k in totales:
+                    totales[k] += stats[k]
+                if stats['total']:
+                    logger.info(f"Ciclo: {stats['total']} procesadas, {stats['exitosos']} exitosas, "
+                                f"{stats['fallidos']} fallidas")
+                # Ventas que sólo vuelven a fallar no cuentan como actividad: así no se
+                # reintentan al ritmo mínimo
+                if stats['exitosos']:
+                    intervalo = min_interval
+                else:
+                    intervalo = min(max_interval, intervalo * 2)
+            
+            if self._detener.is_set():
+                break
+            if self._esperar_siguiente_ciclo(intervalo):
+                # La venta avisada puede quedar pendiente un poco después (correlativo
+                # de Flex): volver a consultar seguido por un rato
+                intervalo = min_interval
+        
+        if self._avisos:
+            self._avisos.close()
+            self._avisos = None
+        
+        logger.info(f"Daemon detenido. Total: {totales['total']} procesadas, "
+                    f"{totales['exitosos']} exitosas, {totales['fallidos']} fallidas")
+        self.log_http_metrics()
+        return totales
+    
     def close(self):
         """Cerrar conexiones"""
         self.db.close()
         self.db_flex.close()
+        self.http.close()
+        self.smtp_pool.close()
 
 
 # ============================================================================
 # FUNCIONES AUXILIARES
 # ============================================================================
 
-def show_pending_ventas(agent):
+def show_pending_ventas(agent, full_scan=False):
     """Mostrar ventas pendientes sin procesarlas (dry-run)"""
     print("\n" + "="*80)
     print("VENTAS PENDIENTES DE SINCRONIZACIÓN")
     print("="*80 + "\n")
     
-    ventas = agent.get_pending_ventas()
-    
-    if not ventas:
-        print("✓ No hay ventas pendientes de procesar\n")
-        return
-    
-    print(f"Se encontraron {len(ventas)} ventas pendientes:\n")
+    pendientes = agent.count_pending_ventas()
+    if pendientes is not None:
+        print(f"Ventas pendientes en total: {pendientes}\n")
     
-    for i, venta in enumerate(ventas, 1):
-        print(f"{i}. Venta ID: {venta['id_ventas']}")
+    total = 0
+    for total, venta in enumerate(agent.iter_pending_ventas(full_scan=full_scan), 1):
+        print(f"{total}. Venta ID: {venta['id_ventas']}")
         print(f"   ├─ Total: ${venta['total_ventas']}")
         print(f"   ├─ Fecha: {venta['fecha_venta']}")
         print(f"   ├─ ID Correlativo Flex: {venta['id_correlativo_flex']}")
@@ -902,6 +1737,12 @@ def show_pending_ventas(agent):
         print(f"   └─ ID Cliente: {venta['id_cliente_fk'] or 'N/A'}")
         print()
     
+    if total == 0:
+        print("✓ No hay ventas pendientes de procesar\n")
+        return
+    
+    print(f"Se listaron {total} ventas pendientes\n")
+    
     print("="*80 + "\n")
 
 
@@ -919,14 +1760,30 @@ Ejemplos de uso:
   python flex_sync_agent.py --dry-run
   python flex_sync_agent.py --limit 10
   python flex_sync_agent.py --limit 5 --delay 2
+  python flex_sync_agent.py --workers 4
+  python flex_sync_agent.py --full-scan
+  python flex_sync_agent.py --daemon --workers 2
   python flex_sync_agent.py --api-key "tu_api_key_aqui"
 
 Variables de entorno opcionales:
   FACTURA_X_API_KEY    API Key de Factura X
+  FACTURA_X_ALLOWED_INTERVAL  Segundos mínimos entre envíos (default: claim del token)
+  FACTURA_X_RETRIES    Reintentos ante 429/5xx (default: 3)
+  SMTP_MIN_INTERVAL    Segundos mínimos entre correos de una misma cuenta (default: 1)
   DB_HOST              Host de la base de datos (default: 181.212.204.13)
   DB_PORT              Puerto de la base de datos (default: 3306)
   DB_USER              Usuario de la base de datos (default: root)
   DB_PASSWORD          Contraseña de la base de datos
+  SQLSERVER_HOST       Host de SQL Server Flexline (default: 192.168.1.150)
+  SQLSERVER_POOL_SIZE  Conexiones máximas al pool de SQL Server (default: 5)
+  SYNC_STATE_PATH      Archivo con el último id procesado (default: .flex_sync_state.json)
+  SYNC_LOOKBACK_IDS    Ids revisados hacia atrás en cada ejecución (default: 5000)
+  SYNC_MIN_INTERVAL    Daemon: segundos entre consultas con ventas pendientes (default: 2)
+  SYNC_MAX_INTERVAL    Daemon: segundos máximos entre consultas sin ventas (default: 60, o 300 con avisos)
+  SYNC_FULL_SCAN_INTERVAL  Daemon: segundos entre revisiones completas (default: 3600)
+  SYNC_CRON_FULL_SCAN_INTERVAL  Sin --daemon: segundos entre revisiones completas (default: 86400)
+  SYNC_AGENT_NOTIFY_ADDR   Daemon: host:puerto UDP local donde la app avisa ventas nuevas
+                           (misma variable en la app; sin ella sólo se consulta periódicamente)
         """
     )
     
@@ -958,6 +1815,32 @@ Variables de entorno opcionales:
         help='Segundos de espera entre cada venta (default: 1)'
     )
     
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Ventas procesadas en paralelo; el ritmo lo limita el intervalo permitido por la API (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=None,
+        help=f'Ventas cargadas por lote desde la base de datos (default: {FlexSyncAgent.BATCH_SIZE})'
+    )
+    
+    parser.add_argument(
+        '--full-scan',
+        action='store_true',
+        help='Revisar todas las ventas pendientes, no sólo las posteriores al último id procesado'
+    )
+    
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Quedar en ejecución consultando ventas pendientes; termina con SIGTERM o Ctrl+C'
+    )
+    
     parser.add_argument(
         '--dry-run',
         action='store_true',
@@ -994,11 +1877,19 @@ Variables de entorno opcionales:
         
         # Si es dry-run, solo mostrar ventas pendientes
         if args.dry_run:
-            show_pending_ventas(agent)
+            show_pending_ventas(agent, full_scan=args.full_scan)
+            return 0
+        
+        if args.daemon:
+            # SIGTERM (systemd, docker stop) y Ctrl+C terminan las ventas en curso antes de salir
+            signal.signal(signal.SIGTERM, lambda signum, frame: agent.request_stop())
+            signal.signal(signal.SIGINT, lambda signum, frame: agent.request_stop())
+            agent.run_daemon(batch_size=args.batch_size, workers=args.workers)
             return 0
         
         # Ejecutar el agente
-        stats = agent.run(limit=args.limit, delay=args.delay)
+        stats = agent.run(limit=args.limit, delay=args.delay, batch_size=args.batch_size, workers=args.workers,
+                          full_scan=args.full_scan)
         
         # Retornar código de salida basado en resultados
         if stats['total'] == 0:
@@ -1,9 +1,17 @@
 from flask_app import app
 from flask_app.controllers import users_controller
+from flask_app import commands
 # Crear la aplicación Flask
 # Force reload
 if __name__ == '__main__':
     import os
     # host='0.0.0.0' permite conexiones desde otros dispositivos
     debug_mode = os.environ.get('FLASK_DEBUG', '0') == '1'
-    app.run(host='0.0.0.0', debug=debug_mode, port=5001)
\ No newline at end of file
+    # Con el reloader de debug sólo el proceso hijo (WERKZEUG_RUN_MAIN) atiende requests:
+    # los hilos de fondo se inician sólo ahí.
+    if not debug_mode or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Precarga del catálogo en segundo plano
+        if os.environ.get('CATALOG_WARMUP', '1') == '1':
+            from flask_app.models.productos import start_catalog_warmer
+            start_catalog_warmer()
+    app.run(host='0.0.0.0', debug=debug_mode, port=5001)